@@ -0,0 +1,233 @@
+"""Per-student progress aggregates, kept up to date as each graded session is stored.
+
+HistoryStore.add calls `apply` inside the same transaction that inserts the
+record, so the aggregates are never out of step with the history. Readers
+(ProgressAnalytics, the Progress page) only touch a few indexed rows per
+student, however long the history grows. Rows are kept per ISO week and for
+all time; the empty student "" holds the whole class.
+
+    python analytics.py report --student Alice
+    python analytics.py rebuild            # recompute from history, e.g. after changing MISTAKE_PATTERNS
+"""
+import argparse
+import datetime
+import json
+import re
+
+from tasks import MATH_TOPICS
+
+ALL_STUDENTS = ""
+ALL_TIME = "all"
+SHEET = ""  # topic of the one-per-sheet row that counts sessions
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS progress (
+        student TEXT NOT NULL,
+        subject TEXT NOT NULL,
+        topic TEXT NOT NULL,
+        period TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        graded INTEGER NOT NULL DEFAULT 0,
+        correct INTEGER NOT NULL DEFAULT 0,
+        last_at TEXT,
+        PRIMARY KEY (student, subject, topic, period)
+    );
+    CREATE TABLE IF NOT EXISTS mistakes (
+        student TEXT NOT NULL,
+        subject TEXT NOT NULL,
+        topic TEXT NOT NULL,
+        tag TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        last_at TEXT,
+        PRIMARY KEY (student, subject, topic, tag)
+    );
+"""
+
+# Tags for what went wrong, matched against the feedback on incorrect answers.
+MISTAKE_PATTERNS = {
+    "sign error": re.compile(r"\bsign\b|\bnegative\b", re.IGNORECASE),
+    "arithmetic slip": re.compile(r"arithmetic|miscalculat|calculation error|computed incorrectly", re.IGNORECASE),
+    "fractions": re.compile(r"simplif|common denominator|numerator|denominator", re.IGNORECASE),
+    "order of operations": re.compile(r"order of operations|[BP]I?[DE]MAS|BODMAS", re.IGNORECASE),
+    "units": re.compile(r"\bunits?\b", re.IGNORECASE),
+    "misread question": re.compile(r"misread|misunderst|the question asks", re.IGNORECASE),
+    "missing working": re.compile(r"no working|show (?:your|the|all) (?:working|steps)|nothing written|incomplete",
+                                  re.IGNORECASE),
+}
+OTHER_MISTAKE = "other"
+
+
+def week_of(timestamp):
+    """ISO week ("2026-W07") of a record's `YYYY-MM-DD_HH-MM-SS` timestamp."""
+    try:
+        day = datetime.datetime.strptime(timestamp[:10], "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        day = datetime.date.today()
+    year, week, _ = day.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def mistake_tags(feedback_text):
+    tags = [tag for tag, pattern in MISTAKE_PATTERNS.items() if pattern.search(feedback_text or "")]
+    return tags or [OTHER_MISTAKE]
+
+
+def outcomes(record):
+    """(topic, correct or None if not judged, mistake tags) for each graded question of a record."""
+    if record.get("subject") != "Math":
+        return []
+    results = []
+    feedback = record.get("feedback") or {}
+    for number in record.get("problems") or {}:
+        topic = MATH_TOPICS.get(int(number), f"Q{number}")
+        entry = feedback.get(str(number))
+        correct = entry.get("correct") if isinstance(entry, dict) else None
+        if not isinstance(correct, bool):
+            correct = None
+        tags = mistake_tags(entry.get("feedback")) if correct is False else []
+        results.append((topic, correct, tags))
+    return results
+
+
+# === Writing (called by HistoryStore inside its transaction) ===
+def ensure_schema(db):
+    """Create the aggregate tables; returns True when they were just created."""
+    created = db.execute("SELECT 1 FROM sqlite_master WHERE name = 'progress'").fetchone() is None
+    db.executescript(SCHEMA)
+    return created
+
+
+def apply(db, record):
+    """Add one graded session to the aggregates."""
+    students = [ALL_STUDENTS] + ([record["student"]] if record.get("student") else [])
+    subject = record["subject"]
+    at = record["timestamp"]
+    periods = (ALL_TIME, week_of(at))
+    rows = [(SHEET, 1, 0, 0)]
+    for topic, correct, _ in outcomes(record):
+        rows.append((topic, 1, int(correct is not None), int(bool(correct))))
+    for student in students:
+        for period in periods:
+            db.executemany(
+                "INSERT INTO progress (student, subject, topic, period, attempts, graded, correct, last_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (student, subject, topic, period) DO UPDATE SET "
+                "attempts = attempts + excluded.attempts, graded = graded + excluded.graded, "
+                "correct = correct + excluded.correct, last_at = max(coalesce(last_at, ''), excluded.last_at)",
+                [(student, subject, topic, period, attempts, graded, correct, at)
+                 for topic, attempts, graded, correct in rows],
+            )
+        db.executemany(
+            "INSERT INTO mistakes (student, subject, topic, tag, count, last_at) VALUES (?, ?, ?, ?, 1, ?) "
+            "ON CONFLICT (student, subject, topic, tag) DO UPDATE SET "
+            "count = count + 1, last_at = max(coalesce(last_at, ''), excluded.last_at)",
+            [(student, subject, topic, tag, at) for topic, _, tags in outcomes(record) for tag in tags],
+        )
+
+
+def rebuild(db):
+    """Recompute every aggregate from the stored records (one full scan)."""
+    db.execute("DELETE FROM progress")
+    db.execute("DELETE FROM mistakes")
+    count = 0
+    for (record,) in db.execute("SELECT record FROM sessions ORDER BY id").fetchall():
+        apply(db, json.loads(record))
+        count += 1
+    return count
+
+
+# === Reading ===
+def _accuracy(row):
+    row["accuracy"] = round(row["correct"] / row["graded"], 3) if row["graded"] else None
+    return row
+
+
+class ProgressAnalytics:
+    """Read API over the aggregates; shares the HistoryStore's connection and lock."""
+
+    def __init__(self, db, lock):
+        self._db = db
+        self._lock = lock
+
+    def _rows(self, sql, args):
+        with self._lock:
+            cursor = self._db.execute(sql, args)
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def overview(self, student=None):
+        """Sessions per subject, with Math accuracy, for one student or the class."""
+        rows = self._rows(
+            "SELECT subject, attempts AS sessions, last_at FROM progress "
+            "WHERE student = ? AND topic = ? AND period = ? ORDER BY subject",
+            (student or ALL_STUDENTS, SHEET, ALL_TIME),
+        )
+        totals = {row["subject"]: row for row in rows}
+        if "Math" in totals:
+            topics = self.topics(student)
+            graded = sum(row["graded"] for row in topics)
+            totals["Math"]["accuracy"] = (
+                round(sum(row["correct"] for row in topics) / graded, 3) if graded else None)
+        return rows
+
+    def topics(self, student=None, subject="Math"):
+        """All-time attempts and accuracy per topic, in question order."""
+        rows = self._rows(
+            "SELECT topic, attempts, graded, correct, last_at FROM progress "
+            "WHERE student = ? AND subject = ? AND period = ? AND topic != ?",
+            (student or ALL_STUDENTS, subject, ALL_TIME, SHEET),
+        )
+        order = {topic: i for i, topic in enumerate(MATH_TOPICS.values())}
+        return [_accuracy(row) for row in sorted(rows, key=lambda row: (order.get(row["topic"], 99), row["topic"]))]
+
+    def trend(self, student=None, subject="Math", weeks=12):
+        """Weekly accuracy per topic for the last `weeks` weeks with any work."""
+        periods = [row["period"] for row in self._rows(
+            "SELECT period FROM progress WHERE student = ? AND subject = ? AND topic = ? AND period != ? "
+            "ORDER BY period DESC LIMIT ?",
+            (student or ALL_STUDENTS, subject, SHEET, ALL_TIME, weeks),
+        )]
+        if not periods:
+            return []
+        return [_accuracy(row) for row in self._rows(
+            "SELECT period AS week, topic, attempts, graded, correct FROM progress "
+            "WHERE student = ? AND subject = ? AND topic != ? AND period >= ? AND period != ? "
+            "ORDER BY period, topic",
+            (student or ALL_STUDENTS, subject, SHEET, min(periods), ALL_TIME),
+        )]
+
+    def mistakes(self, student=None, subject="Math", limit=10):
+        """Most frequent mistake tags by topic."""
+        return self._rows(
+            "SELECT topic, tag, count, last_at FROM mistakes WHERE student = ? AND subject = ? "
+            "ORDER BY count DESC, last_at DESC LIMIT ?",
+            (student or ALL_STUDENTS, subject, limit),
+        )
+
+    def report(self, student=None, weeks=12):
+        return {
+            "student": student,
+            "overview": self.overview(student),
+            "topics": self.topics(student),
+            "trend": self.trend(student, weeks=weeks),
+            "mistakes": self.mistakes(student),
+        }
+
+
+if __name__ == "__main__":
+    from history_store import HISTORY_DB_PATH, HistoryStore
+
+    parser = argparse.ArgumentParser(description="Math Mandala progress analytics.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report = sub.add_parser("report", help="print a student's (or the class's) progress as JSON")
+    report.add_argument("--student")
+    report.add_argument("--weeks", type=int, default=12)
+    report.add_argument("--db", default=HISTORY_DB_PATH)
+    rebuild_cmd = sub.add_parser("rebuild", help="recompute the aggregates from the stored history")
+    rebuild_cmd.add_argument("--db", default=HISTORY_DB_PATH)
+    args = parser.parse_args()
+    store = HistoryStore(args.db)
+    if args.command == "report":
+        print(json.dumps(store.analytics.report(args.student, args.weeks), indent=2))
+    else:
+        print(f"Rebuilt aggregates from {store.rebuild_analytics()} sessions")
@@ -0,0 +1,234 @@
+"""Check a student's final Math answer against the answer key without calling a model.
+
+Answer keys are strings such as "20", "3/4" or "10/3; 16/3" (several values,
+in any order). Numbers are compared exactly as fractions; symbolic answers
+such as "2x + 6" are compared with SymPy when it is installed. `check`
+returns True or False only when it is sure, and None when the answer cannot
+be read reliably, so those questions go to the LLM as before.
+"""
+import ast
+import operator
+import re
+from fractions import Fraction
+
+CORRECT_FEEDBACK = "✅ Correct: your final answer matches the answer key. Well done!"
+
+_LATEX = [
+    (re.compile(r"\\(?:mathrm|text|operatorname)\s*\{[^{}]*\}(?:\s*\^\s*\{[^{}]*\})?"), " "),  # units, words
+    (re.compile(r"\\[dt]?frac\s*\{([^{}]*)\}\s*\{([^{}]*)\}"), r"(\1)/(\2)"),
+    (re.compile(r"\\(?:times|cdot)"), "*"),
+    (re.compile(r"\\div"), "/"),
+    (re.compile(r"\\%"), "%"),
+    (re.compile(r"\\(?:left|right|[()\[\]]|[,;:!~ ])|\$"), " "),
+    (re.compile(r"\^\s*\{([^{}]*)\}"), r"^(\1)"),
+]
+# A run of characters that can make up a numeric expression.
+_NUMERIC_RUN_RE = re.compile(r"[-+(]*\d[\d\s.+\-*/()^%]*")
+_ANSWER_MARKER_RE = re.compile(r"^.*?\b(?:final\s+)?ans(?:wer)?\b\s*[:=-]?", re.IGNORECASE)
+_CLAUSE_SPLIT_RE = re.compile(r"[,;]|\band\b", re.IGNORECASE)
+_SYMBOLIC_RE = re.compile(r"[0-9a-zA-Z\s.+\-*/^()]+")
+# Unit words after a number in an answer key entry ("2 liters", "54 cm^2").
+_KEY_UNITS_RE = re.compile(r"\s+[a-zA-Z]{2,}(?:\^\d)?(?:\s+[a-zA-Z]+)*$")
+# Bounds on what is evaluated from OCR text: a short line of working must not be able to
+# spell out a number that takes minutes to compute, e.g. ((9^10)^10)^10 or 9^9^9^9.
+MAX_EXPRESSION_CHARS = 80
+MAX_EXPONENT = 10
+MAX_VALUE_BITS = 512
+
+_sympy = None
+
+
+def _load_sympy():
+    """SymPy, imported on first use (it costs ~35 MiB and 0.3 s); None when not installed."""
+    global _sympy
+    if _sympy is None:
+        try:
+            import sympy
+            import sympy.parsing.sympy_parser
+        except ImportError:  # optional: without it only numeric answers are checked locally
+            sympy = False
+        _sympy = sympy
+    return _sympy or None
+
+
+_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+}
+
+
+def normalize(text):
+    """Plain-text form of Mathpix output: LaTeX fractions, operators and units simplified."""
+    for pattern, replacement in _LATEX:
+        text = pattern.sub(replacement, text)
+    return text.replace("{", "(").replace("}", ")").replace("−", "-").replace("×", "*").replace("÷", "/")
+
+
+# === Values ===
+def _is_pow(node):
+    return isinstance(node, ast.BinOp) and isinstance(node.op, ast.Pow)
+
+
+def _bounded(value):
+    if max(value.numerator.bit_length(), value.denominator.bit_length()) > MAX_VALUE_BITS:
+        raise ValueError("value too large")
+    return value
+
+
+def _evaluate(node):
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        return _bounded(Fraction(str(node.value)))
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+        value = _evaluate(node.operand)
+        return -value if isinstance(node.op, ast.USub) else value
+    if isinstance(node, ast.BinOp) and type(node.op) in _OPS:
+        return _bounded(_OPS[type(node.op)](_evaluate(node.left), _evaluate(node.right)))
+    if _is_pow(node):
+        # Checked before evaluating anything: a power of a power grows without bound.
+        if any(_is_pow(child) for side in (node.left, node.right) for child in ast.walk(side)):
+            raise ValueError("chained powers")
+        base, exponent = _evaluate(node.left), _evaluate(node.right)
+        if exponent.denominator != 1 or abs(exponent) > MAX_EXPONENT:
+            raise ValueError("unsupported exponent")
+        return _bounded(base ** int(exponent))
+    raise ValueError("not a numeric expression")
+
+
+def parse_number(text):
+    """Exact value of a numeric expression such as "10/3", "0.75" or "75%"; None if unreadable."""
+    text = text.strip().rstrip(".")
+    percent = text.endswith("%")
+    text = text.rstrip("%").replace("^", "**")
+    if not text or "%" in text or len(text) > MAX_EXPRESSION_CHARS:
+        return None
+    try:
+        value = _evaluate(ast.parse(text, mode="eval").body)
+    except (SyntaxError, ValueError, ZeroDivisionError, RecursionError):
+        return None
+    return value / 100 if percent else value
+
+
+def _powers(sympy, expr):
+    """The powers in an unevaluated expression, leaving out the x**-1 that SymPy writes for division."""
+    return [node for node in sympy.preorder_traversal(expr) if isinstance(node, sympy.Pow) and node.exp != -1]
+
+
+def _safe_powers(sympy, expr):
+    """False for chained powers or a numeric exponent above MAX_EXPONENT, which SymPy would expand."""
+    for power in _powers(sympy, expr):
+        if _powers(sympy, power.base) or _powers(sympy, power.exp):
+            return False
+        if not power.exp.free_symbols:
+            exponent = power.exp.doit()  # only + - * / of numbers here, so cheap
+            if not exponent.is_Rational or abs(exponent) > MAX_EXPONENT:
+                return False
+    return True
+
+
+def parse_symbolic(text):
+    """SymPy expression for an answer such as "2x + 6"; None without SymPy or if unreadable."""
+    text = text.strip()
+    # Only digits, operators and single-letter variables ever reach parse_expr.
+    if (len(text) > MAX_EXPRESSION_CHARS or not _SYMBOLIC_RE.fullmatch(text)
+            or re.search(r"[a-zA-Z]{2}", text) or re.search(r"\.\D|\D\.", text)):
+        return None
+    sympy = _load_sympy()
+    if sympy is None:
+        return None
+    parser = sympy.parsing.sympy_parser
+    transformations = parser.standard_transformations + (parser.implicit_multiplication_application,)
+    text = text.replace("^", "**")
+    try:
+        # Inspect the unevaluated tree first; evaluating 9^9^9^9 would never finish.
+        if not _safe_powers(sympy, parser.parse_expr(text, transformations=transformations, evaluate=False)):
+            return None
+        return parser.parse_expr(text, transformations=transformations, evaluate=True)
+    except Exception:
+        return None
+
+
+def parse_expected(spec):
+    """The values in an answer key entry, or None if any of them can't be checked locally."""
+    values = []
+    for part in str(spec).split(";"):
+        part = _KEY_UNITS_RE.sub("", normalize(part).strip())
+        value = parse_number(part)
+        if value is None:
+            value = parse_symbolic(part)
+        if value is None:
+            return None
+        values.append(value)
+    return values or None
+
+
+# === Student answers ===
+def final_answer(segment):
+    """The student's final answer: the last line of working that contains a digit."""
+    lines = [line.strip() for line in normalize(segment or "").splitlines() if re.search(r"\d", line)]
+    if not lines:
+        return ""
+    return _ANSWER_MARKER_RE.sub("", lines[-1]).strip()
+
+
+def _candidates(answer, numeric):
+    """The value each clause of the final answer ends with (the right of its last `=`)."""
+    candidates = []
+    for clause in _CLAUSE_SPLIT_RE.split(answer):
+        rhs = clause.rsplit("=", 1)[-1]
+        if numeric:
+            run = _NUMERIC_RUN_RE.search(rhs)
+            text = run.group(0).strip() if run else ""
+            value = parse_number(text) if text else None
+        else:
+            text = rhs.strip()
+            value = parse_symbolic(text) if text else None
+        if value is not None:
+            candidates.append((text, value))
+    return candidates
+
+
+def _same(written, value, expected):
+    if isinstance(expected, Fraction):
+        if not isinstance(value, Fraction):
+            return False
+        if value == expected:
+            return True
+        # A decimal rounded to 2+ places counts, e.g. 3.33 for 10/3.
+        decimals = re.fullmatch(r"-?\d*\.(\d{2,})", written.replace(" ", ""))
+        return bool(decimals) and round(float(expected), len(decimals.group(1))) == float(value)
+    sympy = _load_sympy()
+    try:
+        return sympy.simplify(sympy.sympify(value) - expected) == 0
+    except Exception:
+        return False
+
+
+def check(expected_spec, segment):
+    """Return (verdict, final answer text); verdict is True, False or None when unsure."""
+    expected = parse_expected(expected_spec)
+    answer = final_answer(segment)
+    if expected is None or not answer:
+        return None, answer
+    numeric = all(isinstance(value, Fraction) for value in expected)
+    if not numeric:
+        expected = [_load_sympy().sympify(value) for value in expected]
+    candidates = _candidates(answer, numeric)
+    if not candidates:
+        return None, answer
+    if len(expected) == 1:
+        written, value = candidates[-1]
+        if _same(written, value, expected[0]):
+            return True, answer
+        # The right value somewhere other than the end of the line is left to the LLM.
+        if any(_same(w, v, expected[0]) for w, v in candidates[:-1]):
+            return None, answer
+        return False, answer
+    unmatched = list(candidates)
+    for target in expected:
+        match = next((c for c in unmatched if _same(c[0], c[1], target)), None)
+        if match is None:
+            return (False if len(candidates) >= len(expected) else None), answer
+        unmatched.remove(match)
+    return True, answer
@@ -1,32 +1,112 @@
 import streamlit as st
-from openai import OpenAI
-import requests
-import base64
 from PIL import Image
-import re
 import os
 import toml
-import time
-import json
 import logging
-
-if os.path.exists("/etc/secrets/secrets.toml"):
-    st_secrets = toml.load("/etc/secrets/secrets.toml")
-else:
-    st_secrets = st.secrets
+import time
+from urllib.parse import urlencode
+
+import imaging
+from history_store import HistoryStore
+import http_client
+from jobs import JobQueue
+from metrics import MetricsLog
+import pipeline
+from result_cache import ResultCache
+from task_pool import TaskPool
+from tasks import DIFFICULTIES
+import uploads
+import worker
 
 # === CONFIG ===
-MATHPIX_APP_ID = st_secrets["MATHPIX_APP_ID"]
-MATHPIX_APP_KEY = st_secrets["MATHPIX_APP_KEY"]
-client = OpenAI(api_key=st_secrets["OPENAI_API_KEY"])
-RENDER_UPLOADS_URL = "https://mathmandala-upload.onrender.com/uploads"
-RENDER_FILE_BASE = "https://mathmandala-upload.onrender.com/files"
-RENDER_DELETE_ALL = "https://mathmandala-upload.onrender.com/delete-all"
-HISTORY_DIR = ".history"
-os.makedirs(HISTORY_DIR, exist_ok=True)
+CAPTURE_PAGE_URL = "https://akmandala.github.io/mathmandala/capture.html"
+HISTORY_PAGE_SIZE = 20
+# Other processes (batch grading) also write history, so listings expire on their own too.
+HISTORY_LISTING_TTL = 30
+JOB_POLL_SECONDS = 0.5
+# Stop following a job after this long, e.g. when no worker is running; it stays in the queue.
+JOB_FOLLOW_SECONDS = 300
+# Grading threads mostly wait on Mathpix and OpenAI, so a class's uploads are graded side by side.
+# bench_replay: 30 sheets over 10 s wait 46 s in the queue (p50) with 1 worker, 1.7 s with 8.
+IN_APP_WORKERS = 8
+
+# === Cached resources (built once per server process, not on every rerun) ===
+@st.cache_resource
+def load_secrets():
+    if os.path.exists("/etc/secrets/secrets.toml"):
+        return toml.load("/etc/secrets/secrets.toml")
+    return st.secrets
+
+@st.cache_resource
+def load_logo():
+    logo = Image.open("mathmandala_logo.png")
+    logo.load()
+    return logo
+
+@st.cache_resource
+def get_history():
+    return HistoryStore()
+
+@st.cache_resource
+def get_result_cache():
+    return ResultCache()
+
+@st.cache_resource
+def get_client():
+    return http_client.LazyOpenAIClient(load_secrets()["OPENAI_API_KEY"])
+
+@st.cache_resource
+def get_grading():
+    st_secrets = load_secrets()
+    return pipeline.GradingPipeline(
+        get_client(), st_secrets["MATHPIX_APP_ID"], st_secrets["MATHPIX_APP_KEY"], get_history(),
+        cache=get_result_cache(), math_mode=st_secrets.get("MATH_GRADING_MODE", "per_question"),
+        metrics_log=MetricsLog(),
+    )
+
+@st.cache_resource
+def get_job_queue():
+    return JobQueue()
+
+@st.cache_resource
+def start_in_app_workers():
+    """Worker threads in the web process; set IN_APP_WORKERS = 0 when running worker.py instead."""
+    count = int(load_secrets().get("IN_APP_WORKERS", IN_APP_WORKERS))
+    return worker.start_threads(get_grading(), get_job_queue(), count)
+
+@st.cache_resource
+def get_task_pool():
+    task_pool = TaskPool(get_client())
+    task_pool.warm()
+    return task_pool
+
+# === Cached history listings (cleared whenever this app saves a session) ===
+@st.cache_data(ttl=HISTORY_LISTING_TTL)
+def list_sessions(page, subject, student):
+    return get_history().list(page, HISTORY_PAGE_SIZE, subject=subject, student=student)
+
+@st.cache_data(ttl=HISTORY_LISTING_TTL)
+def count_sessions(subject, student):
+    return get_history().count(subject=subject, student=student)
+
+@st.cache_data(ttl=HISTORY_LISTING_TTL)
+def list_students():
+    return get_history().students()
+
+def clear_history_listings():
+    list_sessions.clear()
+    count_sessions.clear()
+    list_students.clear()
+
+history = get_history()
+result_cache = get_result_cache()
+grading = get_grading()
+task_pool = get_task_pool()
+job_queue = get_job_queue()
+start_in_app_workers()
 
 # === Load Logo ===
-logo = Image.open("mathmandala_logo.png")
+logo = load_logo()
 col1, col2 = st.columns([1, 8])
 with col1:
     st.image(logo, width=90)
@@ -36,44 +116,221 @@ with col2:
 # === Sidebar History ===
 with st.sidebar:
     st.header("📚 History")
-    history_files = sorted([f for f in os.listdir(HISTORY_DIR) if f.endswith(".json")])
-    selected = st.selectbox("View Past Session", ["None"] + history_files[::-1])
-    if selected != "None":
-        with open(os.path.join(HISTORY_DIR, selected), "r") as f:
-            past = json.load(f)
-        st.session_state.selected_history = past
+    subject_filter = st.selectbox("Subject", ["All", "Math", "Story Mountain", "Biology"])
+    student_filter = st.selectbox("Student", ["All"] + list_students())
+    filters = {
+        "subject": None if subject_filter == "All" else subject_filter,
+        "student": None if student_filter == "All" else student_filter,
+    }
+    pages = max(1, -(-count_sessions(**filters) // HISTORY_PAGE_SIZE))
+    page = st.number_input("Page", min_value=1, max_value=pages, value=1) - 1 if pages > 1 else 0
+    sessions = {
+        s["id"]: f"{s['timestamp']} · {s['subject']}" + (f" · {s['student']}" if s["student"] else "")
+        for s in list_sessions(page, **filters)
+    }
+    selected = st.selectbox(
+        "View Past Session", [None] + list(sessions),
+        format_func=lambda session_id: "None" if session_id is None else sessions[session_id],
+    )
+    if selected is not None:
+        thumbnail = history.thumbnail(selected)
+        if thumbnail:
+            st.image(thumbnail)
+        st.session_state.selected_history = history.get(selected)
     else:
         st.session_state.selected_history = None
 
-# === Helper: Download Latest File from Render ===
-def fetch_latest_image(prefix="mathmandala_", timeout=60):
-    start = time.time()
-    while time.time() - start < timeout:
+# === Helpers ===
+def show_timings(durations, run_metrics=None):
+    with st.expander("⏱️ Stage timings"):
+        for name, secs in durations.items():
+            st.markdown(f"- **{name}**: {secs:.2f}s")
+        if run_metrics:
+            tokens = run_metrics["tokens"]
+            rss = (run_metrics.get("memory") or {}).get("rss_peak_mb")
+            st.caption(f"Estimated cost ${run_metrics['cost_usd']:.4f} · "
+                       f"{tokens['prompt']} prompt + {tokens['completion']} completion tokens · "
+                       f"{run_metrics['bytes']['out'] / 1024:.0f} KiB sent"
+                       + (f" · peak RSS {rss:.0f} MiB" if rss else ""))
+        stats = result_cache.stats
+        st.caption(f"Result cache: {stats['hits']} hits, {stats['misses']} misses, "
+                   f"{stats['entries']} entries")
+        http_stats = http_client.stats()
+        st.caption("Services: " + ", ".join(
+            f"{name} {breaker['state']}" for name, breaker in http_stats["breakers"].items()
+        ))
+        st.caption("Grading queue: " + ", ".join(
+            f"{count} {status}" for status, count in job_queue.counts().items()
+        ))
+        st.json(http_stats, expanded=False)
+
+def capture_url(name, token, subject):
+    settings = imaging.settings_for(subject)
+    query = {
+        "name": name,
+        "token": token,
+        "upload": uploads.UPLOAD_SERVICE_URL,
+        "maxEdge": settings["max_edge"],
+        "quality": settings["quality"] / 100,
+        "gray": int(settings["grayscale"]),
+    }
+    return f"{CAPTURE_PAGE_URL}?{urlencode(query)}"
+
+def submit_when_uploaded(subject, student_name, capture_token, missing_message, **payload):
+    """Show the capture page, wait for this capture's upload and queue it for grading."""
+    st.components.v1.iframe(
+        capture_url(student_name, capture_token, subject),
+        height=720,
+        scrolling=True
+    )
+
+    st.info("⏳ Waiting for your uploaded pages from the camera...")
+    started = time.perf_counter()
+    with st.spinner("Looking for your pages..."):
         try:
-            res = requests.get(RENDER_UPLOADS_URL)
-            if res.status_code == 200:
-                files = sorted([f for f in res.json().get("files", []) if f.startswith(prefix) and f.endswith(".jpg")])
-                if files:
-                    latest = files[-1]
-                    image_url = f"{RENDER_FILE_BASE}/{latest}"
-                    img_data = requests.get(image_url).content
-                    with open("temp_upload.jpg", "wb") as f:
-                        f.write(img_data)
-                    try:
-                        Image.open("temp_upload.jpg").verify()
-                        return "temp_upload.jpg", latest
-                    except:
-                        os.remove("temp_upload.jpg")
+            submission = uploads.wait_for_submission(capture_token, timeout=120)  # Extend timeout here
         except Exception as e:
-            st.warning(f"Error checking uploads: {e}")
-        time.sleep(2)
-    return None, None
+            st.warning(f"Error fetching upload: {e}")
+            return
+    if not submission:
+        st.warning(missing_message)
+        return
+    submission_id, filenames = submission
+    # Grading continues in a worker even if this tab is closed; the result lands in History.
+    st.session_state.active_job = job_queue.submit(
+        submission_id, subject,
+        dict(payload, pages=filenames, student=student_name, upload_wait_s=time.perf_counter() - started),
+    )
+    follow_job(st.session_state.active_job)
+
+def show_question_feedback(slot, data):
+    if not isinstance(data, dict) or "error" in data:
+        slot.warning("Feedback for this question could not be read.")
+        return
+    with slot.container():
+        student_answer = data.get("student_answer", "⚠️ No answer detected.")
+        st.code(student_answer, language="text")
+
+        feedback = data.get("feedback", "⚠️ No feedback received.")
+        st.markdown("**🎓 Feedback:**")
+        st.markdown(feedback)
+
+FEEDBACK_HEADINGS = {
+    "Story Mountain": "📖 Feedback on Story Plan",
+    "Biology": "🧬 Feedback on Biology Diagram",
+}
+SPINNER_TEXT = {
+    "Math": "Reading sheet with MathPix and sending to AI...",
+    "Story Mountain": "Reading your story and providing feedback...",
+    "Biology": "Analyzing your diagram with GPT-4 Vision...",
+}
+
+def follow_job(job_id):
+    """Render a grading job's feedback as the worker reports it, until the job finishes."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return
+    subject = job["subject"]
+    was_running = job["status"] not in ("done", "failed")
+    image_box = st.empty()
+    status_box = st.empty()
+    if subject == "Math":
+        slots = {}
+        for q_num, question in job["payload"]["problems"].items():
+            st.markdown(f"---\n### Q{q_num}. {question}")
+            slots[str(q_num)] = st.empty()
+            slots[str(q_num)].caption("⏳ Waiting for feedback...")
+    else:
+        feedback_box = st.empty()
+
+    shown = {}
+    deadline = time.monotonic() + JOB_FOLLOW_SECONDS
+    with st.spinner(SPINNER_TEXT[subject]):
+        while time.monotonic() < deadline:
+            progress = job["progress"] or {}
+            if subject == "Math":
+                for key, entry in progress.get("feedback", {}).items():
+                    if key in slots and shown.get(key) != entry:
+                        show_question_feedback(slots[key], entry)
+                        shown[key] = entry
+            elif progress.get("text") and shown.get("text") != progress["text"]:
+                shown["text"] = progress["text"]
+                with feedback_box.container():
+                    st.success(FEEDBACK_HEADINGS[subject])
+                    st.markdown(progress["text"])
+            if job["status"] in ("done", "failed"):
+                break
+            status_box.caption("⏳ Queued for grading..." if job["status"] == "queued" else "")
+            time.sleep(JOB_POLL_SECONDS)
+            job = job_queue.get(job_id)
+    status_box.empty()
+
+    if job["status"] not in ("done", "failed"):
+        where = "still queued" if job["status"] == "queued" else "still being graded"
+        st.info(f"⏳ Your sheet is {where}. Its feedback will appear in History once it is graded.")
+        return
+
+    if job["status"] == "failed":
+        st.warning(f"Grading failed: {job['error']}")
+        return
+    if was_running:
+        clear_history_listings()
+    image_bytes = history.image(job["history_id"])
+    if image_bytes:
+        image_box.image(image_bytes, caption="Captured Sheet", use_container_width=True)
+    record = history.get(job["history_id"])
+    if subject == "Math":
+        for key, slot in slots.items():
+            if key in record["feedback"]:
+                show_question_feedback(slot, record["feedback"][key])
+            else:
+                slot.warning("No feedback received for this question.")
+    elif record["feedback"]:
+        with feedback_box.container():
+            st.success(FEEDBACK_HEADINGS[subject])
+            st.markdown(record["feedback"])
+    show_timings(job["timings"] or {}, record.get("metrics"))
+
+def run_math(difficulty, student_name, capture_token):
+    task = task_pool.take("Math", difficulty, student_name)
+    problems = task["problems"]
+
+    st.markdown("Students should label their answers `Q1.`, `Q2.`, etc. Use as many pages as needed: "
+                "capture each page in order, then submit them together.")
+    with st.expander("📝 Questions"):
+        for i in range(1, 7):
+            st.markdown(f"**Q{i}.** {problems[i]}")
+
+    submit_when_uploaded("Math", student_name, capture_token,
+                         "No new image received in time. Please try again.", problems=problems, answers=task["answers"])
+
+def run_story(difficulty, student_name, capture_token):
+    st.markdown("Students should complete their Story Mountain using the printable template.")
+    st.subheader("🧠 Creative Writing Prompt")
+    task = task_pool.take("Story Mountain", difficulty, student_name)
+    st.markdown(task)
+
+    submit_when_uploaded("Story Mountain", student_name, capture_token,
+                         "No story image received in time. Please try again.", task=task)
+
+def run_biology(difficulty, student_name, capture_token):
+    st.markdown("Students should draw and label the assigned biological system.")
+    st.subheader("🧪 Biology Drawing Task")
+    task = task_pool.take("Biology", difficulty, student_name)
+    st.markdown(task)
+
+    submit_when_uploaded("Biology", student_name, capture_token,
+                         "No biology drawing received in time. Please try again.", task=task)
+
+SUBJECT_FLOWS = {"Math": run_math, "Story Mountain": run_story, "Biology": run_biology}
 
 # === Main Execution ===
 if st.session_state.selected_history:
     data = st.session_state.selected_history
     st.subheader(f"📖 Review: {data['timestamp']} - {data['subject']}")
-    st.image(data["image"], caption="Past Submission", use_container_width=True)
+    image_bytes = history.image(data["id"])
+    if image_bytes:
+        st.image(image_bytes, caption="Past Submission", use_container_width=True)
     if data['subject'] == "Math":
         for q_num, question in data["problems"].items():
             st.markdown(f"---\n### Q{q_num}. {question}")
@@ -102,380 +359,12 @@ if st.session_state.selected_history:
         st.markdown("### 📖 Feedback")
         st.markdown(data["feedback"], unsafe_allow_html=True)
 else:
-    subject = st.selectbox("Select Subject", ["Math", "Story Mountain", "Biology"])
+    subject = st.selectbox("Select Subject", list(SUBJECT_FLOWS))
+    difficulty = st.selectbox("Difficulty", DIFFICULTIES, index=DIFFICULTIES.index("challenging"))
+    student_name = st.text_input("Student Name", placeholder="Same name you enter on the capture page").strip() or "unknown"
     if st.button("🚀 Generate Task"):
-        if subject == "Math":
-            def generate_dynamic_problems():
-                prompt = """
-Generate 6 challenging and diverse Year 7 math problems. Each should come from a different area:
-Q1. Algebra
-Q2. Geometry
-Q3. Fractions or Decimals
-Q4. Ratio or Proportion
-Q5. Probability
-Q6. Statistics or Averages
-Number them from 1 to 6 in this format:
-Q1. [question text]
-...etc
-Do not include answers.
-"""
-                #response = client.chat.completions.create(
-                #    model="gpt-4",
-                #    messages=[{"role": "user", "content": prompt}],
-                #    temperature=0.4
-                #)
-                #text = response.choices[0].message.content
-                text = """
-Q1. Three numbers a, b, and c satisfy the following equations: a + b = 12; b + c = 15; a + c = 13. Find the value of a + b + c.
-Q2. A rectangle with dimensions 10 cm by 6 cm has a right-angled triangle cut out from one corner. The triangle’s legs (along the rectangle’s sides) are 4 cm and 3 cm. Calculate the area of the remaining shape.
-Q3. Solve the equation: x/3 + x/4 = 7.
-Q4. A fruit punch is made by mixing orange juice and pineapple juice in the ratio 5:3. If 2 liters of pineapple juice are used, how many liters of orange juice are needed, and what is the total volume of the punch?
-Q5. A bag contains 4 red balls, 5 blue balls, and 3 green balls. If you pick one ball without looking, what is the probability that it is not green?
-Q6. The mean of five numbers is 10. When a sixth number is added, the mean becomes 11. What is the sixth number?
-                """
-                problems = {}
-                for line in text.strip().split("\n"):
-                    match = re.match(r'^Q?(\d+)\.\s*(.+)', line.strip())
-                    if match:
-                        number = int(match.group(1))
-                        problems[number] = match.group(2)
-                return problems
-
-            def ocr_with_mathpix_full(image_path):
-                with open(image_path, "rb") as image_file:
-                    img_base64 = base64.b64encode(image_file.read()).decode()
-        
-                headers = {
-                    "app_id": MATHPIX_APP_ID,
-                    "app_key": MATHPIX_APP_KEY,
-                    "Content-type": "application/json"
-                }
-        
-                data = {
-                    "src": f"data:image/jpeg;base64,{img_base64}",
-                    "formats": ["text"],
-                    "ocr": ["math", "text"]
-                }
-        
-                response = requests.post("https://api.mathpix.com/v3/text", json=data, headers=headers)
-                full_text = response.json().get("text", "")
-                return full_text
-        
-            def get_openai_math_feedback_full(questions_dict, ocr_text, image_path):
-                with open(image_path, "rb") as img_file:
-                    image_b64 = base64.b64encode(img_file.read()).decode()
-                    
-                import json, re
-                prompt = f"""
-You are a math tutor reviewing a scanned student worksheet. You will receive:
-
-1. The full OCR text extracted from the image (including all workings).
-2. The list of 6 original questions.
-
-Your task:
-- For each question Q1 to Q6, match the student's corresponding handwritten answer from the OCR.
-- Review the student's solution using the OCR text.
-- Provide detailed feedback per question, including any mistakes and detailed steps how to correct them.
-- Return a JSON object with keys 1 to 6.
-
-OCR Text:
-{ocr_text}
-
-Questions:
-{json.dumps(questions_dict, indent=2)}
-
-Reply with JSON:
-"""
-                response = client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=0.2,
-                    max_tokens=1500
-                )
-        
-                try:
-                    raw = response.choices[0].message.content
-                    match = re.search(r"\{.*\}", raw, re.DOTALL)
-                    if match:
-                        return json.loads(match.group(0))
-                    else:
-                        return {"error": "No JSON detected", "raw": raw}
-                except Exception as e:
-                    return {"error": str(e), "raw": response.choices[0].message.content}
-        
-            PROBLEMS = generate_dynamic_problems()
-        
-            st.markdown("Students should answer all 6 questions on **one sheet**, label them `Q1.`, `Q2.`, etc.")
-            with st.expander("📝 Questions"):
-                for i in range(1, 7):
-                    st.markdown(f"**Q{i}.** {PROBLEMS[i]}")
-
-            st.components.v1.iframe(
-                "https://akmandala.github.io/mathmandala/capture.html",
-                height=720,
-                scrolling=True
-            )
-            
-            placeholder = st.empty()
-            st.info("⏳ Waiting for your uploaded image from the camera...")
-            with st.spinner("Looking for your image..."):
-                image_path, image_name = fetch_latest_image(timeout=120)  # Extend timeout here
-            if image_path:
-                placeholder.image(image_path, caption="Captured by Math Mandala Extension", use_container_width=True)
-                with st.spinner("Reading sheet with MathPix and sending to AI..."):
-                    ocr_text = ocr_with_mathpix_full(image_path)
-                    feedback_json = get_openai_math_feedback_full(PROBLEMS, ocr_text, image_path)
-    
-                feedback_list = feedback_json if isinstance(feedback_json, dict) else {}
-                for q_num, question in PROBLEMS.items():
-                    st.markdown(f"---\n### Q{q_num}. {question}")
-                    
-                    data = feedback_json.get(f"{q_num}")
-                    if not data:
-                        st.warning("No feedback received for this question.")
-                        continue
-                
-                    student_answer = data.get("student_answer", "⚠️ No answer detected.")
-                    st.code(student_answer, language="text")
-
-                    feedback = data.get("feedback", "⚠️ No feedback received.")
-                    st.markdown("**🎓 Feedback:**")
-                    st.markdown(feedback)
-        
-                timestamp = time.strftime("%Y-%m-%d_%H-%M-%S")
-                json_path = os.path.join(HISTORY_DIR, f"{timestamp}.json")
-                Image.open(image_path).convert("RGB").save(os.path.join(HISTORY_DIR, f"{timestamp}.jpg"))
-                with open(json_path, "w") as f:
-                    json.dump({
-                        "timestamp": timestamp,
-                        "subject": subject,
-                        "problems": PROBLEMS,
-                        "ocr_text": ocr_text,
-                        "feedback": feedback_list,
-                        "image": os.path.join(HISTORY_DIR, f"{timestamp}.jpg")
-                    }, f)
-        
-                os.remove(image_path)
-                try:
-                    requests.delete(RENDER_DELETE_ALL)
-                except:
-                    st.warning("Could not delete uploaded files from server.")
-            else:
-                st.warning("No new image received in time. Please try again.")
-
-        elif subject == "Story Mountain":
-            def generate_story_task():
-                prompt = """
-Create a Story Mountain writing task for a Year 7 student.
-Provide the following only:
-
-* Genre
-* Main setting
-* Central character
-* Conflict or challenge
-
-Make it imaginative, challenging, and age-appropriate.
-
-Do not include the Story Mountain structure, summary, or plot outline.
-"""
-                #response = client.chat.completions.create(
-                #    model="gpt-4",
-                #    messages=[{"role": "user", "content": prompt}],
-                #    temperature=0.5
-                #)
-                text = """
-* Genre: Fantasy
-* Main setting: A mystical forest filled with magical creatures and hidden realms.
-* Central character: A timid, 12-year-old girl who discovers she has the ability to communicate with animals.
-* Conflict or challenge: The girl must find and return a stolen artifact to its rightful place in order to restore peace and balance in the forest. She must overcome her shyness, build friendships with the forest creatures, and outwit the cunning thief who is determined to keep the artifact for their own selfish gains.
-                """
-                #return response.choices[0].message.content
-                return text
-            
-            def feedback_on_story(text):
-                prompt = f"""
-Evaluate this Story Mountain plan written by a Year 7 student. Give feedback on whether each part is present (Opening, Build-up, Climax, Falling Action, Ending), the creativity of the story, and how well it fits the assigned challenge.
-
-Student's Story Mountain:
-{text}
-"""
-                response = client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=0.3
-                )
-                return response.choices[0].message.content
-
-            st.markdown("Students should complete their Story Mountain using the printable template.")
-            st.subheader("🧠 Creative Writing Prompt")
-            task = generate_story_task()
-            st.markdown(task)
-
-            st.components.v1.iframe(
-                "https://akmandala.github.io/mathmandala/capture.html",
-                height=720,
-                scrolling=True
-            )
-            
-            placeholder = st.empty()
-            st.info("⏳ Waiting for your uploaded image from the camera...")
-            with st.spinner("Looking for your image..."):
-                image_path, image_name = fetch_latest_image(timeout=120)  # Extend timeout here
-
-            if image_path:
-                placeholder.image(image_path, caption="Captured Story Mountain", use_container_width=True)
-                with open(image_path, "rb") as image_file:
-                    img_base64 = base64.b64encode(image_file.read()).decode()
-                headers = {
-                    "app_id": MATHPIX_APP_ID,
-                    "app_key": MATHPIX_APP_KEY,
-                    "Content-type": "application/json"
-                }
-                data = {
-                    "src": f"data:image/jpeg;base64,{img_base64}",
-                    "formats": ["text"],
-                    "ocr": ["text"]
-                }
-                response = requests.post("https://api.mathpix.com/v3/text", json=data, headers=headers)
-                text = response.json().get("text", "")
-                if text:
-                    with st.spinner("Providing feedback on your story..."):
-                        feedback = feedback_on_story(text)
-                    st.success("📖 Feedback on Story Plan")
-                    st.markdown(feedback)
-
-                    timestamp = time.strftime("%Y-%m-%d_%H-%M-%S")
-                    json_path = os.path.join(HISTORY_DIR, f"{timestamp}.json")
-                    Image.open(image_path).convert("RGB").save(os.path.join(HISTORY_DIR, f"{timestamp}.jpg"))
-                    with open(json_path, "w") as f:
-                        json.dump({
-                            "timestamp": timestamp,
-                            "subject": subject,
-                            "task": task,
-                            "text": text,
-                            "feedback": feedback,
-                            "image": os.path.join(HISTORY_DIR, f"{timestamp}.jpg")
-                        }, f)
-
-                os.remove(image_path)
-                try:
-                    requests.delete(RENDER_DELETE_ALL)
-                except:
-                    st.warning("Could not delete uploaded files from server.")
-            else:
-                st.warning("No story image received in time. Please try again.")
-                
-        elif subject == "Biology":
-            def generate_biology_task():
-                prompt = """
-Generate a high-difficulty Year 8 biology drawing assignment.
-
-The assignment should ask the student to:
-- Draw and clearly label a biological system or structure
-- Include 5–8 correct labels
-- Challenge understanding of form and function
-
-Do not include the drawing or labels — only the instruction.
-"""
-                #response = client.chat.completions.create(
-                #    model="gpt-4",
-                #    messages=[{"role": "user", "content": prompt}],
-                #    temperature=0.5
-                #)
-                text = """
-Assignment:
-
-Draw and label a detailed illustration of the human respiratory system. Your drawing should include the following structures: nasal cavity, pharynx, larynx, trachea, bronchi, lungs, and alveoli.
-
-Each label should not only identify the part, but also include a brief description of its function within the system. Make sure to accurately depict the relative size and location of each structure to demonstrate your understanding of their interrelationships within the system.
-
-To further challenge your understanding of form and function, include a smaller, zoomed-in illustration of an alveolus, showing its structure and how it facilitates the exchange of oxygen and carbon dioxide.
-
-Remember, accuracy and attention to detail are crucial for this assignment. Your drawing should be neat and the labels should be clearly legible.
-                """
-                #return response.choices[0].message.content
-                return text
-
-            def feedback_on_biology_drawing_with_image(image_path):
-                with open(image_path, "rb") as image_file:
-                    image_data = image_file.read()
-                    image_base64 = base64.b64encode(image_data).decode("utf-8")
-        
-                prompt = [
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": """
-You are a biology teacher reviewing a student's hand-drawn and labeled diagram.
-
-Please:
-- Identify whether the drawing shows the correct biological parts (e.g., nasal cavity, lungs, alveoli, etc.)
-- Judge the accuracy of label placements
-- Assess biological correctness
-- Provide clear, constructive feedback for improvement
-
-Now analyze this diagram:
-                                """,
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{image_base64}"
-                                }
-                            }
-                        ]
-                    }
-                ]
-        
-                response = client.chat.completions.create(
-                    model="gpt-4o",
-                    messages=prompt,
-                    max_tokens=1000
-                )
-                return response.choices[0].message.content
-            
-            st.markdown("Students should draw and label the assigned biological system.")
-            st.subheader("🧪 Biology Drawing Task")
-            task = generate_biology_task()
-            st.markdown(task)
-        
-            st.components.v1.iframe(
-                "https://akmandala.github.io/mathmandala/capture.html",
-                height=720,
-                scrolling=True
-            )
-            
-            placeholder = st.empty()
-            st.info("⏳ Waiting for your uploaded image from the camera...")
-            with st.spinner("Looking for your image..."):
-                image_path, image_name = fetch_latest_image(timeout=120)  # Extend timeout here
-            if image_path:
-                placeholder.image(image_path, caption="Captured Biology Drawing", use_container_width=True)
-        
-                with st.spinner("Analyzing your diagram with GPT-4 Vision..."):
-                    feedback = feedback_on_biology_drawing_with_image(image_path)
-        
-                st.success("🧬 Feedback on Biology Diagram")
-                st.markdown(feedback)
-        
-                timestamp = time.strftime("%Y-%m-%d_%H-%M-%S")
-                json_path = os.path.join(HISTORY_DIR, f"{timestamp}.json")
-                Image.open(image_path).convert("RGB").save(os.path.join(HISTORY_DIR, f"{timestamp}.jpg"))
-                with open(json_path, "w") as f:
-                    json.dump({
-                        "timestamp": timestamp,
-                        "subject": subject,
-                        "task": task,
-                        "feedback": feedback,
-                        "image": os.path.join(HISTORY_DIR, f"{timestamp}.jpg")
-                    }, f)
-        
-                os.remove(image_path)
-                try:
-                    requests.delete(RENDER_DELETE_ALL)
-                except:
-                    st.warning("Could not delete uploaded files from server.")
-            else:
-                st.warning("No biology drawing received in time. Please try again.")
+        st.session_state.active_job = None
+        SUBJECT_FLOWS[subject](difficulty, student_name, uploads.new_capture_token())
+    elif st.session_state.get("active_job"):
+        # A rerun (or reconnect) while the last sheet is still being graded: keep following it.
+        follow_job(st.session_state.active_job)
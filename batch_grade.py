@@ -0,0 +1,237 @@
+"""Grade a whole class's scanned worksheets in one headless run.
+
+    python batch_grade.py scans/ --subject Math --workers 8
+    python batch_grade.py term1.zip --problems problems.json --answers answers.json --checkpoint term1.ckpt.json
+
+Each sheet gets a history record in the same shape the app's sidebar
+reads. Finished sheets are recorded in the checkpoint file, so re-running the
+same command after an interruption only grades what is left.
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+
+import config
+import http_client
+import imaging
+import pipeline
+import uploads
+from history_store import HISTORY_DB_PATH, HistoryStore
+from metrics import MetricsLog
+from result_cache import ResultCache
+from tasks import generate_biology_task, generate_math_task, generate_story_task
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".pdf")
+SUBJECTS = ("Math", "Story Mountain", "Biology")
+
+
+# === Sheet discovery ===
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _read_zip_member(zip_path, name):
+    with zipfile.ZipFile(zip_path) as zf:
+        return zf.read(name)
+
+
+def discover_sheets(source):
+    """Return sorted (sheet_id, loader) pairs for every image or PDF in a directory or zip."""
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as zf:
+            names = [
+                n for n in zf.namelist()
+                if n.lower().endswith(IMAGE_EXTENSIONS) and not n.startswith("__MACOSX/")
+            ]
+        return [(name, partial(_read_zip_member, source, name)) for name in sorted(names)]
+    sheets = []
+    for root, _, files in os.walk(source):
+        for name in files:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(root, name)
+                sheets.append((os.path.relpath(path, source), partial(_read_file, path)))
+    return sorted(sheets)
+
+
+def student_from_filename(sheet_id):
+    """mathmandala_<token>_<name>_<time>[_p<i>of<n>].jpg or mathmandala_<name>_<time>.jpg -> name."""
+    stem = os.path.splitext(os.path.basename(sheet_id))[0]
+    stem = re.sub(r"_p\d+of\d+$", "", stem)
+    parts = stem.split("_")
+    if parts[0] == "mathmandala" and len(parts) >= 3:
+        if len(parts) >= 4 and re.fullmatch(r"[0-9a-f]{12}", parts[1]):
+            return "_".join(parts[2:-1])
+        return "_".join(parts[1:-1])
+    return stem
+
+
+# === Checkpoint ===
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.state = {"done": {}, "failed": {}}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+
+    def is_done(self, sheet_id):
+        return sheet_id in self.state["done"]
+
+    def mark(self, sheet_id, history_id=None, error=None):
+        with self._lock:
+            if error is None:
+                self.state["done"][sheet_id] = history_id
+                self.state["failed"].pop(sheet_id, None)
+            else:
+                self.state["failed"][sheet_id] = error
+            if self.path:
+                tmp = self.path + ".tmp"
+                with open(tmp, "w") as f:
+                    json.dump(self.state, f, indent=2)
+                os.replace(tmp, self.path)
+
+
+# === Batch run ===
+def build_pipeline(history_db=HISTORY_DB_PATH, mathpix_concurrency=4, mathpix_per_minute=100,
+                   openai_concurrency=4, openai_per_minute=60, math_mode="per_question",
+                   metrics_log=None):
+    secrets = config.load_secrets()
+    return pipeline.GradingPipeline(
+        http_client.make_openai_client(secrets["OPENAI_API_KEY"], max_retries=5),
+        secrets["MATHPIX_APP_ID"],
+        secrets["MATHPIX_APP_KEY"],
+        HistoryStore(history_db),
+        cache=ResultCache(),
+        throttles={
+            "mathpix": pipeline.Throttle(mathpix_concurrency, mathpix_per_minute),
+            "openai": pipeline.Throttle(openai_concurrency, openai_per_minute),
+        },
+        math_mode=math_mode,
+        metrics_log=metrics_log if metrics_log is not None else MetricsLog(),
+    )
+
+
+def grade_sheet(grading, subject, sheet_id, loader, problems=None, task=None, answers=None):
+    timer = pipeline.StageTimer()
+    with timer.stage("decode"):
+        data = loader()
+        # A PDF is one multi-page sheet.
+        pages = imaging.pdf_pages(data, max_pages=uploads.MAX_PARTS) if imaging.is_pdf(data) else [data]
+        image = [
+            pipeline.SheetImage.decode(imaging.prepare(page, **imaging.settings_for(subject)), sheet_id)
+            for page in pages
+        ]
+    student = student_from_filename(sheet_id)
+    if subject == "Math":
+        record = grading.grade_math(image, problems, timer, student=student, answers=answers)
+    elif subject == "Story Mountain":
+        record = grading.grade_story(image, task, timer, student=student)
+        if not record["text"]:
+            raise ValueError("no text recognised on sheet")
+    else:
+        record = grading.grade_biology(image, task, timer, student=student)
+    record = grading.persist(record, image, timer).result()
+    return record["id"], timer
+
+
+def run_batch(source, subject="Math", problems=None, task=None, workers=8, checkpoint_path=None,
+              grading=None, progress=print, answers=None):
+    """Grade every sheet under `source` (directory or zip); returns a summary dict."""
+    if subject not in SUBJECTS:
+        raise ValueError(f"subject must be one of {SUBJECTS}")
+    if subject == "Math":
+        if not problems:
+            sample = generate_math_task()
+            problems, answers = sample["problems"], answers or sample["answers"]
+    elif subject == "Story Mountain":
+        task = task or generate_story_task()
+    else:
+        task = task or generate_biology_task()
+    grading = grading or build_pipeline()
+    checkpoint = Checkpoint(checkpoint_path)
+
+    sheets = discover_sheets(source)
+    pending = [(sheet_id, loader) for sheet_id, loader in sheets if not checkpoint.is_done(sheet_id)]
+    progress(f"{len(sheets)} sheets found, {len(sheets) - len(pending)} already graded, {len(pending)} to go")
+
+    started = time.monotonic()
+    graded = failed = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="grade") as pool:
+        futures = {
+            pool.submit(grade_sheet, grading, subject, sheet_id, loader, problems, task, answers): sheet_id
+            for sheet_id, loader in pending
+        }
+        for future in as_completed(futures):
+            sheet_id = futures[future]
+            try:
+                history_id, timer = future.result()
+            except Exception as e:
+                failed += 1
+                checkpoint.mark(sheet_id, error=str(e))
+                progress(f"[{graded + failed}/{len(pending)}] {sheet_id}: FAILED ({e})")
+                continue
+            graded += 1
+            checkpoint.mark(sheet_id, history_id)
+            progress(f"[{graded + failed}/{len(pending)}] {sheet_id}: {timer.report()}")
+
+    elapsed = time.monotonic() - started
+    summary = {
+        "sheets": len(sheets),
+        "skipped": len(sheets) - len(pending),
+        "graded": graded,
+        "failed": failed,
+        "elapsed_s": round(elapsed, 1),
+        "sheets_per_minute": round(graded / elapsed * 60, 1) if elapsed else 0.0,
+    }
+    progress(f"Graded {graded} sheets ({failed} failed) in {elapsed:.1f}s "
+             f"= {summary['sheets_per_minute']} sheets/min")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Grade a directory or zip of scanned worksheets.")
+    parser.add_argument("source", help="directory or .zip of scanned sheets (.jpg/.jpeg/.png/.pdf)")
+    parser.add_argument("--subject", choices=SUBJECTS, default="Math")
+    parser.add_argument("--problems", help="JSON file mapping question number to text (Math)")
+    parser.add_argument("--answers", help="JSON file mapping question number to final answer, e.g. \"3/4\" (Math)")
+    parser.add_argument("--task", help="text file with the task description (Story Mountain / Biology)")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--checkpoint", help="resumable progress file (default: <source>.checkpoint.json)")
+    parser.add_argument("--history-db", default=HISTORY_DB_PATH)
+    parser.add_argument("--mathpix-concurrency", type=int, default=4)
+    parser.add_argument("--mathpix-per-minute", type=float, default=100)
+    parser.add_argument("--openai-concurrency", type=int, default=4)
+    parser.add_argument("--openai-per-minute", type=float, default=60)
+    parser.add_argument("--math-mode", choices=pipeline.MATH_MODES, default="per_question")
+    args = parser.parse_args(argv)
+
+    problems = task = answers = None
+    if args.problems:
+        with open(args.problems) as f:
+            problems = {int(k): v for k, v in json.load(f).items()}
+    if args.answers:
+        with open(args.answers) as f:
+            answers = {int(k): v for k, v in json.load(f).items()}
+    if args.task:
+        with open(args.task) as f:
+            task = f.read()
+    grading = build_pipeline(
+        args.history_db, args.mathpix_concurrency, args.mathpix_per_minute,
+        args.openai_concurrency, args.openai_per_minute, args.math_mode,
+    )
+    checkpoint = args.checkpoint or args.source.rstrip("/\\") + ".checkpoint.json"
+    summary = run_batch(args.source, args.subject, problems, task, args.workers, checkpoint, grading,
+                        answers=answers)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,123 @@
+"""Cold-start and per-interaction rerun time of the Streamlit app (via AppTest).
+
+    python bench/bench_app_rerun.py                   # current app.py
+    python bench/bench_app_rerun.py --ref HEAD~1      # app.py from another revision, for comparison
+
+Cold start is the first script run in a fresh process (module imports, client
+construction, history queries, logo decode). Rerun time is measured in one
+process while toggling widgets the way a teacher would. Runs in a scratch
+directory so the real history and caches are untouched; OpenAI is pointed at
+a closed local port so background task generation fails fast.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WARMUP_SECONDS = 3
+SECRETS = {"MATHPIX_APP_ID": "bench", "MATHPIX_APP_KEY": "bench", "OPENAI_API_KEY": "sk-bench"}
+
+
+def _app_test(app_path):
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(app_path, default_timeout=60)
+    for key, value in SECRETS.items():
+        at.secrets[key] = value
+    return at
+
+
+def child_cold(app_path):
+    at = _app_test(app_path)  # imports streamlit's test harness, which is not part of the app
+    start = time.perf_counter()
+    at.run()
+    elapsed = time.perf_counter() - start
+    if at.exception:
+        raise SystemExit(f"app raised: {at.exception[0].message}")
+    print(json.dumps({"cold": elapsed}))
+
+
+def child_rerun(app_path, reruns):
+    at = _app_test(app_path)
+    at.run()
+    # Let start-up background work (task pool warm-up) settle; we want steady-state reruns.
+    time.sleep(WARMUP_SECONDS)
+    times = []
+    for i in range(reruns):
+        # Alternate the subject and sidebar filter, as a teacher browsing would.
+        for box in at.selectbox:
+            if box.label == "Select Subject":
+                box.select_index(i % 3)
+            elif box.label == "Subject":
+                box.select_index(i % 4)
+        start = time.perf_counter()
+        at.run()
+        times.append(time.perf_counter() - start)
+        if at.exception:
+            raise SystemExit(f"app raised: {at.exception[0].message}")
+    print(json.dumps({"reruns": times}))
+
+
+def _run_child(mode, app_path, workdir, *extra):
+    env = dict(os.environ, PYTHONPATH=ROOT, OPENAI_BASE_URL="http://127.0.0.1:9/v1")
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), mode, app_path, *map(str, extra)],
+        cwd=workdir, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ref", help="git revision whose app.py to benchmark instead of the working tree")
+    parser.add_argument("--cold-runs", type=int, default=5)
+    parser.add_argument("--reruns", type=int, default=30)
+    args = parser.parse_args()
+
+    app_path = os.path.join(ROOT, "app.py")
+    if args.ref:
+        # Written next to app.py so it imports this tree's modules.
+        app_path = os.path.join(ROOT, "_bench_app.py")
+        with open(app_path, "w") as f:
+            f.write(subprocess.run(["git", "show", f"{args.ref}:app.py"], cwd=ROOT,
+                                   capture_output=True, text=True, check=True).stdout)
+    try:
+        cold, reruns = [], []
+        for _ in range(args.cold_runs):
+            workdir = tempfile.mkdtemp(prefix="mm-bench-")
+            shutil.copy(os.path.join(ROOT, "mathmandala_logo.png"), workdir)
+            try:
+                cold.append(_run_child("--child-cold", app_path, workdir)["cold"])
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+        workdir = tempfile.mkdtemp(prefix="mm-bench-")
+        shutil.copy(os.path.join(ROOT, "mathmandala_logo.png"), workdir)
+        try:
+            reruns = _run_child("--child-rerun", app_path, workdir, args.reruns)["reruns"]
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    finally:
+        if args.ref:
+            os.remove(app_path)
+
+    label = args.ref or "working tree"
+    print(f"app.py @ {label}")
+    print(f"  cold start (first run, fresh process): median {statistics.median(cold) * 1000:.0f} ms "
+          f"over {len(cold)} runs")
+    reruns.sort()
+    print(f"  rerun: median {statistics.median(reruns) * 1000:.1f} ms, "
+          f"p95 {reruns[int(len(reruns) * 0.95) - 1] * 1000:.1f} ms over {len(reruns)} reruns")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--child-cold":
+        child_cold(sys.argv[2])
+    elif len(sys.argv) > 3 and sys.argv[1] == "--child-rerun":
+        child_rerun(sys.argv[2], int(sys.argv[3]))
+    else:
+        main()
@@ -0,0 +1,146 @@
+"""Peak memory of the worker while several camera photos are graded at once.
+
+    python bench/bench_memory.py                         # working tree, 1/4/8 sheets at once
+    python bench/bench_memory.py --ref HEAD~1            # another revision, for comparison
+    python bench/bench_memory.py --concurrency 8 --pages 3
+
+Each concurrency level runs in a fresh process (Linux: RSS is read from
+/proc) against the local Mathpix / OpenAI / upload stand-ins. Every sheet is
+an unprocessed 12 MP phone photo, as uploaded by old capture pages or chosen
+from the gallery, so the full decode/downscale path runs. The report gives
+the process RSS before grading, the peak while all sheets are in flight, the
+peak growth per sheet and the bytes each sheet adds to the history database.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+class _Sampler(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = _rss_mb()
+        self.stop = threading.Event()
+
+    def run(self):
+        while not self.stop.wait(0.005):
+            self.peak = max(self.peak, _rss_mb())
+
+
+def child(concurrency, pages):
+    import requests
+
+    import mock_services
+    import mock_upload_server
+    servers = {
+        "uploads": mock_upload_server.make_server(),
+        "mathpix": mock_services.make_mathpix_server(faults=mock_services.Faults(300)),
+        "openai": mock_services.make_openai_server(faults=mock_services.Faults(300)),
+    }
+    os.environ["MATHMANDALA_UPLOAD_URL"] = servers["uploads"].url
+    # Imported late: uploads reads MATHMANDALA_UPLOAD_URL at import time.
+    import http_client
+    import pipeline
+    import worker
+    from bench_preprocess import synthetic_sheet
+    from history_store import HistoryStore
+    from jobs import JobQueue
+    from tasks import generate_dynamic_problems
+
+    workdir = tempfile.mkdtemp(prefix="mm-memory-")
+    history = HistoryStore(os.path.join(workdir, "history.sqlite"))
+    grading = pipeline.GradingPipeline(
+        http_client.make_openai_client("sk-bench", base_url=servers["openai"].url + "/v1"),
+        "bench", "bench", history, mathpix_url=servers["mathpix"].url + "/v3/text",
+    )
+    queue = JobQueue(os.path.join(workdir, "jobs.sqlite"))
+    photo = synthetic_sheet()
+    problems = generate_dynamic_problems()
+
+    def submit(i):
+        names = [f"mathmandala_{i:012x}_student{i}_bench" + (f"_p{p}of{pages}.jpg" if pages > 1 else ".jpg")
+                 for p in range(1, pages + 1)]
+        for name in names:
+            requests.post(servers["uploads"].url + "/upload", files={"file": (name, photo, "image/jpeg")},
+                          data={"token": f"{i:012x}"}, timeout=30).raise_for_status()
+        return queue.submit(f"sheet-{i}", "Math", {"problems": problems, "pages": names, "student": f"s{i}"})
+
+    def grade(job_id):
+        job = queue.claim(f"w-{job_id}")
+        worker.run_job(grading, queue, job, f"w-{job_id}")
+
+    # One sheet first so imports, thread pools and connections are warm.
+    grade(submit(0))
+    baseline = _rss_mb()
+    job_ids = [submit(i) for i in range(1, concurrency + 1)]
+    sampler = _Sampler()
+    sampler.start()
+    threads = [threading.Thread(target=grade, args=(job_id,)) for job_id in job_ids]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    sampler.stop.set()
+    sampler.join()
+    history._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    history_bytes = history._db.execute(
+        "SELECT AVG(length(image) + length(thumbnail)) FROM images").fetchone()[0]
+    failed = [job_id for job_id in job_ids if queue.get(job_id)["status"] != "done"]
+    shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps({
+        "concurrency": concurrency, "failed": len(failed), "baseline_mb": baseline, "peak_mb": sampler.peak,
+        "per_sheet_mb": (sampler.peak - baseline) / concurrency, "elapsed_s": elapsed,
+        "history_kib_per_sheet": history_bytes / 1024,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ref", help="git revision to benchmark instead of the working tree")
+    parser.add_argument("--concurrency", default="1,4,8", help="comma-separated sheets graded at once")
+    parser.add_argument("--pages", type=int, default=1, help="photos per sheet")
+    args = parser.parse_args()
+
+    root = ROOT
+    if args.ref:
+        root = tempfile.mkdtemp(prefix="mm-ref-")
+        archive = subprocess.run(["git", "archive", args.ref], cwd=ROOT, capture_output=True, check=True).stdout
+        subprocess.run(["tar", "-x", "-C", root], input=archive, check=True)
+    try:
+        print(f"{args.ref or 'working tree'}: {args.pages} page(s) per sheet")
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.path.join(root, "bench")]))
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", str(concurrency), str(args.pages)],
+                cwd=tempfile.gettempdir(), env=env, capture_output=True, text=True, check=True,
+            ).stdout
+            r = json.loads(out.strip().splitlines()[-1])
+            print(f"  {r['concurrency']} at once: RSS {r['baseline_mb']:.0f} -> peak {r['peak_mb']:.0f} MiB "
+                  f"(+{r['per_sheet_mb']:.1f} MiB per sheet), {r['elapsed_s']:.2f}s, "
+                  f"history {r['history_kib_per_sheet']:.0f} KiB per sheet"
+                  + (f", {r['failed']} FAILED" if r["failed"] else ""))
+    finally:
+        if args.ref:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 3 and sys.argv[1] == "--child":
+        child(int(sys.argv[2]), int(sys.argv[3]))
+    else:
+        main()
@@ -0,0 +1,93 @@
+"""Payload size and OCR impact of upload preprocessing (imaging.prepare).
+
+    python bench/bench_preprocess.py samples/            # size + encode time only
+    python bench/bench_preprocess.py samples/ --ocr      # also compare Mathpix text and latency
+
+Without a sample directory a synthetic camera-resolution sheet is used.
+--ocr needs MATHPIX_APP_ID / MATHPIX_APP_KEY (see config.load_secrets).
+"""
+import argparse
+import base64
+import difflib
+import io
+import os
+import random
+import sys
+import time
+
+from PIL import Image, ImageDraw, ImageFilter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import imaging
+import pipeline
+
+
+def synthetic_sheet(width=4032, height=3024, seed=3):
+    rng = random.Random(seed)
+    img = Image.new("RGB", (width, height), (214, 208, 196))
+    draw = ImageDraw.Draw(img)
+    lines = ["Q1. a+b+c = 20", "Q2. 60 - 6 = 54 cm^2", "Q3. 7x/12 = 7, x = 12",
+             "Q4. 10/3 L orange, 16/3 L total", "Q5. P(not green) = 9/12 = 3/4", "Q6. 66 - 50 = 16"]
+    for i, line in enumerate(lines):
+        draw.text((300, 300 + i * 420), line, fill=(40, 40, 60), font_size=160)
+    for _ in range(4000):
+        x, y = rng.randrange(width), rng.randrange(height)
+        draw.point((x, y), fill=(rng.randrange(150, 230),) * 3)
+    buf = io.BytesIO()
+    img.filter(ImageFilter.GaussianBlur(1.2)).save(buf, "JPEG", quality=95)
+    return buf.getvalue()
+
+
+def load_samples(source):
+    if not source:
+        return [("synthetic.jpg", synthetic_sheet())]
+    samples = []
+    for name in sorted(os.listdir(source)):
+        if name.lower().endswith((".jpg", ".jpeg", ".png")):
+            with open(os.path.join(source, name), "rb") as f:
+                samples.append((name, f.read()))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", nargs="?", help="directory of sample sheets")
+    parser.add_argument("--subject", default="Math", choices=list(imaging.SUBJECT_SETTINGS))
+    parser.add_argument("--ocr", action="store_true", help="run Mathpix on original and preprocessed images")
+    args = parser.parse_args()
+
+    settings = imaging.settings_for(args.subject)
+    grading = None
+    if args.ocr:
+        import config
+        secrets = config.load_secrets()
+        grading = pipeline.GradingPipeline(None, secrets["MATHPIX_APP_ID"], secrets["MATHPIX_APP_KEY"])
+
+    print(f"settings: {settings}")
+    total_before = total_after = 0
+    for name, data in load_samples(args.source):
+        start = time.perf_counter()
+        # max_bytes=0 forces re-encoding, as for an upload from an old capture page.
+        prepared = imaging.prepare(data, max_bytes=0, **settings)
+        prep_ms = (time.perf_counter() - start) * 1000
+        before, after = len(base64.b64encode(data)), len(base64.b64encode(prepared))
+        total_before += before
+        total_after += after
+        line = (f"{name}: request payload {before / 1024:.0f} KiB -> {after / 1024:.0f} KiB "
+                f"({100 * (1 - after / before):.0f}% smaller), preprocess {prep_ms:.0f} ms")
+        if grading:
+            texts, latencies = [], []
+            for variant in (data, prepared):
+                start = time.perf_counter()
+                texts.append(grading._mathpix(pipeline.SheetImage(variant), ("math", "text")))
+                latencies.append(time.perf_counter() - start)
+            similarity = difflib.SequenceMatcher(None, texts[0], texts[1]).ratio()
+            line += (f", mathpix {latencies[0]:.2f}s -> {latencies[1]:.2f}s, "
+                     f"OCR text similarity {similarity:.3f}")
+        print(line)
+    print(f"total request payload {total_before / 1024:.0f} KiB -> {total_after / 1024:.0f} KiB")
+
+
+if __name__ == "__main__":
+    main()
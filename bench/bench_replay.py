@@ -0,0 +1,256 @@
+"""Offline replay benchmark: recorded sheets through the full grading path against local stand-ins.
+
+    python bench/bench_replay.py                                      # synthetic sheets, all subjects
+    python bench/bench_replay.py recordings/ --workers 1,2,4,8 --sheets 60
+    python bench/bench_replay.py --record-from .history/history.sqlite --out recordings/
+    python bench/bench_replay.py --openai-latency-ms 2000 --error-rate 0.05
+    python bench/bench_replay.py --pages 3 --workers 2              # multi-page submissions
+
+Every simulated student uploads a sheet to the upload stand-in (arrivals spread
+over --arrival-seconds, like a class finishing a worksheet). The app side then
+long-polls /wait and queues a grading job, and worker threads download,
+preprocess, OCR, grade and persist it. This is the production code path, with
+Mathpix, OpenAI and the upload service replaced by mock_services /
+mock_upload_server stand-ins that have configurable latency and error rates.
+
+For each worker count the report gives throughput, end-to-end p50/p95/p99
+(upload to graded), failures, per-stage p50/p95 and the peak number of
+concurrent requests each stand-in saw. Where throughput stops growing with
+workers, you have hit a concurrency limit.
+
+Recordings are `<name>.jpg` + `<name>.json` pairs ({"subject", "ocr_text",
+"problems" and "answers", or "task"}). --record-from exports them from a history database,
+so real sheets replay with their real OCR text.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mock_services
+import mock_upload_server
+from metrics import MetricsLog, percentile, stage_latency
+
+SUBJECTS = ("Math", "Story Mountain", "Biology")
+JOB_TIMEOUT = 300
+
+
+# === Recordings ===
+def record_from_history(db_path, out_dir, limit=100):
+    from history_store import HistoryStore
+    store = HistoryStore(db_path)
+    os.makedirs(out_dir, exist_ok=True)
+    written = 0
+    for session in store.list(0, limit):
+        record, image = store.get(session["id"]), store.image(session["id"])
+        if not image:
+            continue
+        name = f"{session['id']:05d}_{record['subject'].replace(' ', '_')}"
+        with open(os.path.join(out_dir, name + ".jpg"), "wb") as f:
+            f.write(image)
+        with open(os.path.join(out_dir, name + ".json"), "w") as f:
+            json.dump({key: record.get(key) for key in ("subject", "ocr_text", "text", "problems", "answers", "task")},
+                      f, indent=2)
+        written += 1
+    print(f"Wrote {written} recordings to {out_dir}")
+
+
+def load_recordings(source):
+    recordings = []
+    for name in sorted(os.listdir(source)):
+        if not name.endswith(".json"):
+            continue
+        with open(os.path.join(source, name)) as f:
+            meta = json.load(f)
+        with open(os.path.join(source, name[:-len(".json")] + ".jpg"), "rb") as f:
+            meta["image"] = f.read()
+        recordings.append(meta)
+    return recordings
+
+
+def synthetic_recordings(per_subject=2):
+    from bench_preprocess import synthetic_sheet
+    from tasks import generate_biology_task, generate_math_task, generate_story_task
+    recordings = []
+    for seed in range(per_subject):
+        image = synthetic_sheet(seed=seed)
+        recordings.append(dict(generate_math_task(), subject="Math", image=image))
+        recordings.append({"subject": "Story Mountain", "image": synthetic_sheet(seed=100 + seed),
+                           "task": generate_story_task()})
+        recordings.append({"subject": "Biology", "image": synthetic_sheet(seed=200 + seed),
+                           "task": generate_biology_task()})
+    return recordings
+
+
+def ocr_answers(recordings):
+    """Mathpix stand-in answers keyed by the SHA-256 of the image the pipeline will send."""
+    import imaging
+    answers = {}
+    for rec in recordings:
+        text = rec.get("ocr_text") or rec.get("text")
+        if text:
+            prepared = imaging.prepare(rec["image"], **imaging.settings_for(rec["subject"]))
+            answers[hashlib.sha256(prepared).hexdigest()] = text
+    return answers
+
+
+# === One scenario ===
+def run_scenario(recordings, workers, sheets, arrival_seconds, servers, math_mode, client_retries, pages=1):
+    # Imported late (here and in the helpers above): uploads reads MATHMANDALA_UPLOAD_URL at import time.
+    import http_client
+    import pipeline
+    import uploads
+    import worker
+    from history_store import HistoryStore
+    from jobs import JobQueue
+
+    workdir = tempfile.mkdtemp(prefix="mm-replay-")
+    for server in servers.values():
+        server.faults.reset()
+    http_client.shared.breakers.clear()
+    http_client.shared.counters.clear()
+    metrics_log = MetricsLog(os.path.join(workdir, "metrics.jsonl"))
+    grading = pipeline.GradingPipeline(
+        http_client.make_openai_client("sk-replay", max_retries=client_retries,
+                                       base_url=servers["openai"].url + "/v1"),
+        "replay", "replay", HistoryStore(os.path.join(workdir, "history.sqlite")),
+        math_mode=math_mode, metrics_log=metrics_log,
+        mathpix_url=servers["mathpix"].url + "/v3/text",
+    )
+    queue = JobQueue(os.path.join(workdir, "jobs.sqlite"))
+    stop = worker.start_threads(grading, queue, workers)
+
+    def student(i):
+        rec = recordings[i % len(recordings)]
+        time.sleep(arrival_seconds * i / max(1, sheets - 1))
+        token = uploads.new_capture_token()
+        started = time.perf_counter()
+        base = f"mathmandala_{token}_student{i}_{int(time.time())}"
+        for page in range(1, pages + 1):
+            requests.post(
+                servers["uploads"].url + "/upload",
+                files={"file": (base + (f"_p{page}of{pages}.jpg" if pages > 1 else ".jpg"),
+                                rec["image"], "image/jpeg")},
+                data={"token": token, "name": f"student{i}"},
+                timeout=30,
+            ).raise_for_status()
+        submission = uploads.wait_for_submission(token, timeout=60)
+        if not submission:
+            return "no upload", time.perf_counter() - started
+        filename, parts = submission
+        payload = {"student": f"student{i}", "pages": parts, "upload_wait_s": time.perf_counter() - started}
+        if rec["subject"] == "Math":
+            payload["problems"] = rec["problems"]
+            payload["answers"] = rec.get("answers") or {}
+        else:
+            payload["task"] = rec["task"]
+        queue.submit(filename, rec["subject"], payload)
+        deadline = time.monotonic() + JOB_TIMEOUT
+        while time.monotonic() < deadline:
+            job = queue.get(filename)
+            if job["status"] in ("done", "failed"):
+                return job["status"], time.perf_counter() - started
+            time.sleep(0.05)
+        return "timeout", time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sheets, thread_name_prefix="student") as pool:
+        outcomes = list(pool.map(student, range(sheets)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+
+    done = [secs for status, secs in outcomes if status == "done"]
+    result = {
+        "workers": workers,
+        "sheets": sheets,
+        "ok": len(done),
+        "failed": len(outcomes) - len(done),
+        "elapsed_s": elapsed,
+        "sheets_per_minute": len(done) / elapsed * 60 if elapsed else 0.0,
+        "e2e": {q: percentile(done, q) for q in (50, 95, 99)} if done else {},
+        "stages": stage_latency(metrics_log.read()),
+        "services": {name: server.faults.stats() for name, server in servers.items()},
+        "breakers": {name: b["times_opened"] for name, b in http_client.stats()["breakers"].items()},
+    }
+    shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def print_result(result):
+    e2e = result["e2e"]
+    print(f"workers={result['workers']:<3} ok {result['ok']}/{result['sheets']}  "
+          f"{result['sheets_per_minute']:.1f} sheets/min  "
+          + (f"e2e p50 {e2e[50]:.2f}s p95 {e2e[95]:.2f}s p99 {e2e[99]:.2f}s" if e2e else "no sheets graded"))
+    print("    peak in flight: " + ", ".join(
+        f"{name} {stats['peak_in_flight']} ({stats['requests']} req, {stats['errors']} injected errors)"
+        for name, stats in result["services"].items()
+    ))
+    if any(result["breakers"].values()):
+        print("    circuit breakers opened: " + ", ".join(
+            f"{name} x{count}" for name, count in result["breakers"].items() if count))
+    print("    stages p50/p95: " + ", ".join(
+        f"{row['stage']} {row['p50_s']:.2f}/{row['p95_s']:.2f}s" for row in result["stages"]
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recordings", nargs="?", help="directory of recorded sheets (default: synthetic)")
+    parser.add_argument("--record-from", metavar="HISTORY_DB", help="export recordings from a history database")
+    parser.add_argument("--out", default="recordings", help="output directory for --record-from")
+    parser.add_argument("--sheets", type=int, default=30)
+    parser.add_argument("--workers", default="1,2,4,8", help="comma-separated worker counts to compare")
+    parser.add_argument("--arrival-seconds", type=float, default=10.0, help="spread of student uploads")
+    parser.add_argument("--pages", type=int, default=1, help="pages per submission")
+    parser.add_argument("--math-mode", choices=("per_question", "whole_sheet"), default="per_question")
+    parser.add_argument("--client-retries", type=int, default=3, help="OpenAI SDK max_retries")
+    parser.add_argument("--mathpix-latency-ms", type=float, default=800)
+    parser.add_argument("--openai-latency-ms", type=float, default=1200)
+    parser.add_argument("--openai-token-ms", type=float, default=5, help="delay between streamed chunks")
+    parser.add_argument("--uploads-latency-ms", type=float, default=150)
+    parser.add_argument("--jitter-ms", type=float, default=200, help="mean of the exponential latency tail")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="injected failure rate for every stand-in")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    if args.record_from:
+        record_from_history(args.record_from, args.out)
+        return
+
+    servers = {
+        "uploads": mock_upload_server.make_server(faults=mock_services.Faults(
+            args.uploads_latency_ms, args.jitter_ms, args.error_rate, seed=1)),
+        "mathpix": mock_services.make_mathpix_server(faults=mock_services.Faults(
+            args.mathpix_latency_ms, args.jitter_ms, args.error_rate, seed=2)),
+        "openai": mock_services.make_openai_server(faults=mock_services.Faults(
+            args.openai_latency_ms, args.jitter_ms, args.error_rate, seed=3), token_ms=args.openai_token_ms),
+    }
+    os.environ["MATHMANDALA_UPLOAD_URL"] = servers["uploads"].url
+    recordings = load_recordings(args.recordings) if args.recordings else synthetic_recordings()
+    servers["mathpix"].RequestHandlerClass.recordings = ocr_answers(recordings)
+
+    print(f"Replaying {args.sheets} sheets from {len(recordings)} recordings "
+          f"({', '.join(sorted({r['subject'] for r in recordings}))}) over {args.arrival_seconds:.0f}s; "
+          f"error rate {args.error_rate:.0%}")
+    results = []
+    for workers in [int(w) for w in args.workers.split(",")]:
+        result = run_scenario(recordings, workers, args.sheets, args.arrival_seconds, servers,
+                              args.math_mode, args.client_retries, args.pages)
+        results.append(result)
+        if not args.json:
+            print_result(result)
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Concurrent-session benchmark for upload routing against the mock upload server.
+
+Compares the old "latest mathmandala_*.jpg wins + delete-all" strategy with
+per-capture tokens, long-poll claiming and per-file deletes.
+
+    python bench/bench_upload_routing.py --sessions 30
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mock_upload_server
+
+PROCESSING_SECONDS = 0.3  # stand-in for OCR + feedback between claim and delete
+
+
+def _capture(server_url, filename, token, session_id, delay):
+    time.sleep(delay)
+    data = {"name": f"student{session_id}"}
+    if token:
+        data["token"] = token
+    requests.post(
+        f"{server_url}/upload",
+        files={"file": (filename, str(session_id).encode(), "image/jpeg")},
+        data=data,
+        timeout=10,
+    )
+
+
+def legacy_session(server_url, session_id, delay, timeout, poll_interval):
+    now = time.strftime("%Y-%m-%dT%H-%M-%S")
+    filename = f"mathmandala_student{session_id}_{now}-{session_id:03d}.jpg"
+    threading.Thread(target=_capture, args=(server_url, filename, None, session_id, delay)).start()
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        res = requests.get(f"{server_url}/uploads", timeout=10)
+        files = sorted(f for f in res.json()["files"] if f.startswith("mathmandala_"))
+        if files:
+            body = requests.get(f"{server_url}/files/{files[-1]}", timeout=10)
+            if body.status_code == 200:
+                time.sleep(PROCESSING_SECONDS)
+                requests.delete(f"{server_url}/delete-all", timeout=10)
+                return time.monotonic() - start, body.content == str(session_id).encode()
+        time.sleep(poll_interval)
+    return None, False
+
+
+def token_session(server_url, session_id, delay, timeout, poll_interval):
+    import uploads
+
+    token = uploads.new_capture_token()
+    now = time.strftime("%Y-%m-%dT%H-%M-%S")
+    filename = f"mathmandala_{token}_student{session_id}_{now}.jpg"
+    threading.Thread(target=_capture, args=(server_url, filename, token, session_id, delay)).start()
+    start = time.monotonic()
+    claimed = uploads.wait_for_upload(token, timeout=timeout)
+    if not claimed:
+        return None, False
+    content = uploads.download(claimed)
+    time.sleep(PROCESSING_SECONDS)
+    uploads.delete(claimed)
+    return time.monotonic() - start, content == str(session_id).encode()
+
+
+def run(strategy, sessions, timeout, poll_interval, seed):
+    server = mock_upload_server.make_server()
+    os.environ["MATHMANDALA_UPLOAD_URL"] = server.url
+    sys.modules.pop("uploads", None)
+    rng = random.Random(seed)
+    delays = [rng.uniform(0, 3) for _ in range(sessions)]
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        results = list(pool.map(
+            lambda i: strategy(server.url, i, delays[i], timeout, poll_interval), range(sessions)
+        ))
+    wall = time.monotonic() - started
+    served = server.store.requests_served
+    server.shutdown()
+    latencies = sorted(r[0] for r in results if r[0] is not None)
+    correct = sum(1 for r in results if r[1])
+    return {
+        "wall_s": wall,
+        "correct": correct,
+        "wrong_or_missing": sessions - correct,
+        "sheets_per_min": correct / wall * 60,
+        "p50_s": latencies[len(latencies) // 2] if latencies else float("nan"),
+        "max_s": latencies[-1] if latencies else float("nan"),
+        "server_requests": served,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=30)
+    parser.add_argument("--timeout", type=float, default=20)
+    parser.add_argument("--poll-interval", type=float, default=2)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    for label, strategy in [("latest-wins + delete-all", legacy_session), ("token + per-file delete", token_session)]:
+        stats = run(strategy, args.sessions, args.timeout, args.poll_interval, args.seed)
+        print(f"{label:26s} " + "  ".join(
+            f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in stats.items()
+        ))
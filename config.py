@@ -0,0 +1,14 @@
+import os
+
+import toml
+
+SECRETS_PATHS = ("/etc/secrets/secrets.toml", os.path.join(".streamlit", "secrets.toml"))
+SECRET_KEYS = ("MATHPIX_APP_ID", "MATHPIX_APP_KEY", "OPENAI_API_KEY")
+
+
+def load_secrets():
+    """Secrets for entry points that run outside Streamlit (batch grading, workers)."""
+    for path in SECRETS_PATHS:
+        if os.path.exists(path):
+            return toml.load(path)
+    return {key: os.environ[key] for key in SECRET_KEYS if key in os.environ}
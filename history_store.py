@@ -0,0 +1,252 @@
+"""SQLite-backed history of graded sessions.
+
+Listing only touches the indexed metadata columns; the full record (OCR text,
+feedback) and the image are loaded on demand for the one session being
+reviewed. Images are stored as size-capped WebP (see compact_image). Each
+add also updates the progress aggregates in `analytics`, in the same
+transaction; `store.analytics` reads them.
+Existing `.history/*.json` + `.jpg` pairs can be imported, and images stored
+before compaction shrunk, with
+
+    python history_store.py migrate .history
+    python history_store.py compact
+"""
+import argparse
+import io
+import json
+import os
+import sqlite3
+import threading
+
+from PIL import Image
+
+import analytics
+
+HISTORY_DIR = ".history"
+HISTORY_DB_PATH = os.path.join(HISTORY_DIR, "history.sqlite")
+THUMBNAIL_EDGE = 240
+# Stored images only need to be legible when a teacher reviews a session.
+IMAGE_MAX_WIDTH = 1200
+IMAGE_MAX_PIXELS = 6_000_000  # a stack of several pages
+IMAGE_MAX_BYTES = 300 * 1024
+IMAGE_QUALITIES = (60, 45, 30)
+
+
+def make_thumbnail(img, edge=THUMBNAIL_EDGE):
+    img = img.copy()
+    img.thumbnail((edge, edge))
+    buf = io.BytesIO()
+    img.convert("RGB").save(buf, "JPEG", quality=70)
+    return buf.getvalue()
+
+
+def _encode_webp(img, quality):
+    buf = io.BytesIO()
+    img.save(buf, "WEBP", quality=quality, method=4)
+    return buf.getvalue()
+
+
+def compact_image(image_bytes, max_width=IMAGE_MAX_WIDTH, max_pixels=IMAGE_MAX_PIXELS,
+                  max_bytes=IMAGE_MAX_BYTES):
+    """Return (stored image, thumbnail) from one decode: WebP of at most `max_bytes` plus a JPEG thumbnail.
+
+    The image is scaled to fit `max_width` and `max_pixels`, then the quality
+    is lowered (and finally the size halved) until it fits `max_bytes`.
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    img = img.convert("L" if img.mode in ("L", "LA", "1") else "RGB")
+    scale = min(1.0, max_width / img.width, (max_pixels / (img.width * img.height)) ** 0.5)
+    if scale < 1.0:
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+    while True:
+        for quality in IMAGE_QUALITIES:
+            data = _encode_webp(img, quality)
+            if len(data) <= max_bytes:
+                break
+        if len(data) <= max_bytes or min(img.size) < 2 * THUMBNAIL_EDGE:
+            break
+        img = img.reduce(2)
+    return data, make_thumbnail(img)
+
+
+class HistoryStore:
+    def __init__(self, path=HISTORY_DB_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS sessions (
+                id INTEGER PRIMARY KEY,
+                timestamp TEXT NOT NULL,
+                subject TEXT NOT NULL,
+                student TEXT,
+                record TEXT NOT NULL,
+                legacy_name TEXT UNIQUE
+            );
+            CREATE INDEX IF NOT EXISTS sessions_timestamp ON sessions (timestamp);
+            CREATE INDEX IF NOT EXISTS sessions_subject ON sessions (subject, timestamp);
+            CREATE INDEX IF NOT EXISTS sessions_student ON sessions (student, timestamp);
+            CREATE TABLE IF NOT EXISTS images (
+                session_id INTEGER PRIMARY KEY REFERENCES sessions (id) ON DELETE CASCADE,
+                image BLOB,
+                thumbnail BLOB
+            );
+        """)
+        self._db.commit()
+        if analytics.ensure_schema(self._db) and self.count():
+            # First open since analytics were added: aggregate the existing history once.
+            self.rebuild_analytics()
+        self.analytics = analytics.ProgressAnalytics(self._db, self._lock)
+
+    def rebuild_analytics(self):
+        with self._lock, self._db:
+            return analytics.rebuild(self._db)
+
+    def add(self, record, image_bytes=None, legacy_name=None):
+        """Store one graded session and return its id."""
+        record = {k: v for k, v in record.items() if k != "image"}
+        image_bytes, thumbnail = compact_image(image_bytes) if image_bytes else (None, None)
+        with self._lock, self._db:
+            cur = self._db.execute(
+                "INSERT INTO sessions (timestamp, subject, student, record, legacy_name) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (record["timestamp"], record["subject"], record.get("student"),
+                 json.dumps(record), legacy_name),
+            )
+            session_id = cur.lastrowid
+            self._db.execute(
+                "INSERT INTO images (session_id, image, thumbnail) VALUES (?, ?, ?)",
+                (session_id, image_bytes, thumbnail),
+            )
+            analytics.apply(self._db, record)
+        return session_id
+
+    @staticmethod
+    def _filters(subject, student):
+        clauses, args = [], []
+        if subject:
+            clauses.append("subject = ?")
+            args.append(subject)
+        if student:
+            clauses.append("student = ?")
+            args.append(student)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", args
+
+    def list(self, page=0, page_size=20, subject=None, student=None):
+        """Newest-first metadata for one page of sessions (no feedback or images)."""
+        where, args = self._filters(subject, student)
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT id, timestamp, subject, student FROM sessions{where} "
+                "ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?",
+                args + [page_size, page * page_size],
+            ).fetchall()
+        return [dict(zip(("id", "timestamp", "subject", "student"), row)) for row in rows]
+
+    def count(self, subject=None, student=None):
+        where, args = self._filters(subject, student)
+        with self._lock:
+            return self._db.execute(f"SELECT COUNT(*) FROM sessions{where}", args).fetchone()[0]
+
+    def students(self):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT DISTINCT student FROM sessions WHERE student IS NOT NULL ORDER BY student"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def get(self, session_id):
+        with self._lock:
+            row = self._db.execute("SELECT record FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        record = json.loads(row[0])
+        record["id"] = session_id
+        return record
+
+    def has_legacy(self, legacy_name):
+        with self._lock:
+            return self._db.execute(
+                "SELECT 1 FROM sessions WHERE legacy_name = ?", (legacy_name,)
+            ).fetchone() is not None
+
+    def _blob(self, column, session_id):
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {column} FROM images WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def image(self, session_id):
+        return self._blob("image", session_id)
+
+    def thumbnail(self, session_id):
+        return self._blob("thumbnail", session_id)
+
+    def compact(self, progress=print):
+        """Re-store images saved before compaction; returns bytes saved. Run VACUUM afterwards to shrink the file."""
+        with self._lock:
+            ids = [row[0] for row in self._db.execute(
+                "SELECT session_id FROM images WHERE image IS NOT NULL AND "
+                "(length(image) > ? OR substr(image, 9, 4) != CAST('WEBP' AS BLOB))", (IMAGE_MAX_BYTES,)
+            )]
+        saved = 0
+        for session_id in ids:
+            before = self.image(session_id)
+            image, thumbnail = compact_image(before)
+            with self._lock, self._db:
+                self._db.execute("UPDATE images SET image = ?, thumbnail = ? WHERE session_id = ?",
+                                 (image, thumbnail, session_id))
+            saved += len(before) - len(image)
+        progress(f"Compacted {len(ids)} images, {saved / 1024 / 1024:.1f} MiB saved")
+        return saved
+
+    def vacuum(self):
+        with self._lock:
+            self._db.execute("VACUUM")
+
+
+def migrate_json_dir(store, directory=HISTORY_DIR, progress=print):
+    """Import legacy `<timestamp>.json` (+ `.jpg`) history files; safe to re-run."""
+    imported = skipped = 0
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".json"):
+            continue
+        if store.has_legacy(name):
+            skipped += 1
+            continue
+        with open(os.path.join(directory, name)) as f:
+            record = json.load(f)
+        image_bytes = None
+        # `image` was saved relative to the app's cwd; the file sits next to the JSON.
+        image_name = os.path.basename(record.get("image") or name[:-len(".json")] + ".jpg")
+        image_path = os.path.join(directory, image_name)
+        if os.path.exists(image_path):
+            with open(image_path, "rb") as f:
+                image_bytes = f.read()
+        else:
+            progress(f"{name}: image {image_name} not found, importing without it")
+        store.add(record, image_bytes, legacy_name=name)
+        imported += 1
+    progress(f"Imported {imported} sessions, {skipped} already present")
+    return imported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Math Mandala history store tools.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate = sub.add_parser("migrate", help="import legacy .history/*.json files")
+    migrate.add_argument("directory", nargs="?", default=HISTORY_DIR)
+    migrate.add_argument("--db", default=HISTORY_DB_PATH)
+    compact = sub.add_parser("compact", help="shrink images stored before compaction, then VACUUM")
+    compact.add_argument("--db", default=HISTORY_DB_PATH)
+    args = parser.parse_args()
+    if args.command == "migrate":
+        migrate_json_dir(HistoryStore(args.db), args.directory)
+    else:
+        store = HistoryStore(args.db)
+        store.compact()
+        store.vacuum()
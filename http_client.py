@@ -0,0 +1,263 @@
+"""Shared outbound HTTP layer: keep-alive pooling, timeouts, retries, circuit breakers.
+
+Every call to the upload service and Mathpix goes through `shared`, and the
+OpenAI client is built by `make_openai_client` so it gets the same pooling,
+timeouts and statistics. `stats()` returns a snapshot for monitoring.
+"""
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# (connect, read) seconds per endpoint; long-poll requests pass their own.
+ENDPOINT_TIMEOUTS = {
+    "uploads.list": (5, 10),
+    "uploads.file": (5, 30),
+    "uploads.delete": (5, 10),
+    "mathpix": (5, 60),
+}
+DEFAULT_TIMEOUT = (5, 30)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Keep-alive connections per host: grading workers each download several pages at once.
+POOL_SIZE = 32
+# /wait long-polls get a pool of their own. Every open app session holds one for up to 35 s,
+# so a class of 30 would otherwise crowd downloads and Mathpix calls out of the main pool.
+LONG_POLL_POOL_SIZE = 64
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of calling a service whose circuit breaker is open."""
+
+
+def is_service_failure(error):
+    """True for errors that mean the service is unhealthy: connection errors, timeouts, 429/5xx.
+
+    Client errors such as 400/401 and exceptions raised by our own callbacks
+    are not the service's fault, so they must not open its breaker.
+    """
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status in RETRY_STATUSES
+    # APIConnectionError also covers the SDK's timeouts; openai is only imported once a client exists.
+    openai = sys.modules.get("openai")
+    return openai is not None and isinstance(error, openai.APIConnectionError)
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures; lets one trial call through after `reset_after` s."""
+
+    def __init__(self, name, failure_threshold=5, reset_after=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_after:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    self.times_opened += 1
+                self.opened_at = time.monotonic()
+
+    @contextmanager
+    def guard(self):
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} circuit is open; not calling the service")
+        try:
+            yield
+        except Exception as e:
+            if is_service_failure(e):
+                self.record_failure()
+            else:
+                # The service answered; a client error or our own bug says nothing about its health.
+                self.record_success()
+            raise
+        self.record_success()
+
+
+class HttpClient:
+    def __init__(self, pool_size=POOL_SIZE, long_poll_pool_size=LONG_POLL_POOL_SIZE, retries=3, backoff=0.5,
+                 max_backoff=8):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session, self.adapter = self._session(pool_size)
+        self.long_poll_session, self.long_poll_adapter = self._session(long_poll_pool_size)
+        self.breakers = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _session(pool_size):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session, adapter
+
+    def breaker(self, service):
+        with self._lock:
+            if service not in self.breakers:
+                self.breakers[service] = CircuitBreaker(service)
+            return self.breakers[service]
+
+    def count(self, endpoint, name, amount=1):
+        with self._lock:
+            counters = self.counters.setdefault(
+                endpoint, {"requests": 0, "retries": 0, "failures": 0, "seconds": 0.0}
+            )
+            counters[name] += amount
+
+    def _sleep_before_retry(self, attempt, response=None):
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt) * (0.5 + random.random() / 2)
+        if response is not None and response.headers.get("Retry-After", "").isdigit():
+            delay = max(delay, float(response.headers["Retry-After"]))
+        time.sleep(delay)
+
+    def request(self, method, url, endpoint, timeout=None, retry=True, long_poll=False, **kwargs):
+        """Send one request for `endpoint` ("service.name"), retrying 429/5xx and connection errors.
+
+        `long_poll` requests, which the server holds open, use their own connection pool.
+        """
+        session = self.long_poll_session if long_poll else self.session
+        breaker = self.breaker(endpoint.split(".")[0])
+        timeout = timeout or ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT)
+        attempts = self.retries + 1 if retry else 1
+        for attempt in range(attempts):
+            if not breaker.allow():
+                raise CircuitOpenError(f"{breaker.name} circuit is open; not calling {endpoint}")
+            start = time.perf_counter()
+            self.count(endpoint, "requests")
+            try:
+                response = session.request(method, url, timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self.count(endpoint, "seconds", time.perf_counter() - start)
+                breaker.record_failure()
+                if attempt + 1 == attempts:
+                    self.count(endpoint, "failures")
+                    raise
+                self.count(endpoint, "retries")
+                self._sleep_before_retry(attempt)
+                continue
+            self.count(endpoint, "seconds", time.perf_counter() - start)
+            if response.status_code not in RETRY_STATUSES:
+                breaker.record_success()
+                return response
+            breaker.record_failure()
+            if attempt + 1 == attempts:
+                self.count(endpoint, "failures")
+                return response
+            self.count(endpoint, "retries")
+            self._sleep_before_retry(attempt, response)
+
+    def get(self, url, endpoint, **kwargs):
+        return self.request("GET", url, endpoint, **kwargs)
+
+    def post(self, url, endpoint, **kwargs):
+        return self.request("POST", url, endpoint, **kwargs)
+
+    def delete(self, url, endpoint, **kwargs):
+        return self.request("DELETE", url, endpoint, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            endpoints = {name: dict(values) for name, values in self.counters.items()}
+            breakers = {
+                name: {"state": b.state, "consecutive_failures": b.failures, "times_opened": b.times_opened}
+                for name, b in self.breakers.items()
+            }
+        pools = {}
+        for label, adapter in (("", self.adapter), (" (long-poll)", self.long_poll_adapter)):
+            manager_pools = adapter.poolmanager.pools
+            for key in manager_pools.keys():
+                pool = manager_pools.get(key)
+                if pool is None:
+                    continue
+                pools[f"{key.key_scheme}://{key.key_host}{label}"] = {
+                    "connections_opened": pool.num_connections,
+                    "requests": pool.num_requests,
+                    "free_slots": pool.pool.qsize() if pool.pool else 0,
+                }
+        return {"endpoints": endpoints, "breakers": breakers, "pools": pools}
+
+
+shared = HttpClient()
+
+
+def make_openai_client(api_key, max_retries=3, timeout=60.0, http=shared, base_url=None):
+    """OpenAI client on a pooled httpx transport, with request counts fed into `http.stats()`."""
+    import openai
+
+    def on_response(response):
+        http.count("openai", "requests")
+        if response.status_code >= 400:
+            http.count("openai", "failures")
+
+    # DefaultHttpxClient keeps the SDK's keep-alive connection limits.
+    transport = openai.DefaultHttpxClient(
+        timeout=openai.Timeout(timeout, connect=5.0),
+        event_hooks={"response": [on_response]},
+    )
+    # The OpenAI SDK already retries 429/5xx with exponential backoff.
+    return openai.OpenAI(api_key=api_key, max_retries=max_retries, http_client=transport, base_url=base_url)
+
+
+class LazyOpenAIClient:
+    """Stands in for `make_openai_client(...)`, importing the SDK and building it on first use.
+
+    Importing openai takes about half a second, which the Streamlit app would
+    otherwise pay before rendering anything on a cold start.
+    """
+
+    def __init__(self, api_key, **kwargs):
+        self._kwargs = dict(kwargs, api_key=api_key)
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        with self._lock:
+            if self._client is None:
+                self._client = make_openai_client(**self._kwargs)
+        return getattr(self._client, name)
+
+
+def stats():
+    return shared.stats()
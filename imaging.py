@@ -0,0 +1,102 @@
+import io
+
+from PIL import Image, ImageOps
+
+# Handwriting stays legible to Mathpix well below camera resolution.
+MAX_EDGE = 1600
+JPEG_QUALITY = 80
+# Uploads at or under these limits are passed through untouched.
+MAX_UPLOAD_BYTES = 600 * 1024
+# PDF pages are rendered at this resolution, then downscaled like photos.
+PDF_DPI = 150
+
+# Biology diagrams are graded by a vision model and often rely on colour.
+SUBJECT_SETTINGS = {
+    "Math": {"grayscale": True, "normalize": True},
+    "Story Mountain": {"grayscale": True, "normalize": True},
+    "Biology": {"grayscale": False, "normalize": False},
+}
+
+
+def settings_for(subject):
+    settings = {"max_edge": MAX_EDGE, "quality": JPEG_QUALITY}
+    settings.update(SUBJECT_SETTINGS.get(subject, {}))
+    return settings
+
+
+def prepare(data, max_edge=MAX_EDGE, quality=JPEG_QUALITY, grayscale=True, normalize=True,
+            max_bytes=MAX_UPLOAD_BYTES):
+    """Return JPEG bytes for OCR, downscaling and recompressing oversized uploads.
+
+    capture.html already does this in the browser, so a typical upload is a
+    small JPEG and comes back unchanged; only oversized or non-JPEG files
+    (older capture pages, scanner output in batch runs) are re-encoded.
+    """
+    img = Image.open(io.BytesIO(data))
+    is_jpeg = img.format == "JPEG"
+    if is_jpeg and max(img.size) <= max_edge and len(data) <= max_bytes:
+        return data
+
+    if is_jpeg:
+        # Let the JPEG decoder scale down (and drop colour) while decoding, so a
+        # 12 MP photo never exists in memory at full size. draft() only picks a
+        # scale that keeps the image at least this big; thumbnail() does the rest.
+        scale = min(1.0, max_edge / max(img.size))
+        img.draft("L" if grayscale else "RGB", (round(img.width * scale), round(img.height * scale)))
+    img = ImageOps.exif_transpose(img)
+    if max(img.size) > max_edge:
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    if grayscale:
+        img = img.convert("L")
+        if normalize:
+            img = ImageOps.autocontrast(img, cutoff=1)
+    else:
+        img = img.convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=quality, optimize=True)
+    return buf.getvalue()
+
+
+# === Multi-page submissions ===
+def is_pdf(data):
+    return data[:5] == b"%PDF-"
+
+
+def pdf_pages(data, dpi=PDF_DPI, max_pages=None):
+    """Render each page of a PDF to JPEG bytes (needs the optional pypdfium2 package)."""
+    try:
+        import pypdfium2
+    except ImportError:
+        raise ValueError("PDF uploads need the pypdfium2 package (pip install pypdfium2).")
+    pdf = pypdfium2.PdfDocument(data)
+    try:
+        count = len(pdf) if max_pages is None else min(len(pdf), max_pages)
+        pages = []
+        for index in range(count):
+            img = pdf[index].render(scale=dpi / 72).to_pil()
+            buf = io.BytesIO()
+            img.convert("RGB").save(buf, "JPEG", quality=90)
+            pages.append(buf.getvalue())
+        return pages
+    finally:
+        pdf.close()
+
+
+def stack_pages(pages, width=MAX_EDGE, quality=JPEG_QUALITY):
+    """One tall JPEG of several page images, top to bottom, for history and review."""
+    images = [Image.open(io.BytesIO(data)) for data in pages]
+    width = min(width, max(img.width for img in images))
+    scaled = []
+    for img in images:
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        if img.width != width:
+            img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+        scaled.append(img)
+    sheet = Image.new("RGB", (width, sum(img.height for img in scaled)), "white")
+    top = 0
+    for img in scaled:
+        sheet.paste(img, (0, top))
+        top += img.height
+    buf = io.BytesIO()
+    sheet.save(buf, "JPEG", quality=quality, optimize=True)
+    return buf.getvalue()
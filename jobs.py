@@ -0,0 +1,166 @@
+"""SQLite-backed grading job queue shared by the app and worker processes.
+
+A job is keyed by the upload it grades (the uploaded file name), so submitting
+the same upload twice returns the existing job instead of paying for OCR and
+feedback again. Workers claim jobs with a lease; a job whose worker dies is
+picked up again once the lease runs out, up to `max_attempts` times. A job
+queued again after an error is not claimed before its backoff has passed
+(kept in `lease_until` while it is queued).
+
+Job states: queued -> running -> done | failed.
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from history_store import HISTORY_DIR
+
+JOBS_DB_PATH = os.path.join(HISTORY_DIR, "jobs.sqlite")
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 3
+# A retried job waits RETRY_BACKOFF_SECONDS * 2**attempts (30 s, then 60 s), so a short outage,
+# an open circuit breaker (30 s) or a cold start does not use up every attempt at once.
+RETRY_BACKOFF_SECONDS = 15
+JOB_FIELDS = ("id", "subject", "payload", "status", "attempts", "worker", "lease_until",
+              "progress", "history_id", "error", "timings", "created_at", "updated_at")
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+class JobQueue:
+    def __init__(self, path=JOBS_DB_PATH, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS,
+                 retry_backoff=RETRY_BACKOFF_SECONDS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        # Autocommit mode so claim() can take the write lock up front with BEGIN IMMEDIATE.
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.executescript("""
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                subject TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                lease_until REAL,
+                progress TEXT,
+                history_id INTEGER,
+                error TEXT,
+                timings TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+        """)
+
+    def submit(self, upload_id, subject, payload):
+        """Queue grading for `upload_id`; a repeat submission returns the existing job unchanged."""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO jobs (id, subject, payload, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (upload_id, subject, json.dumps(payload), now, now),
+            )
+        return upload_id
+
+    def claim(self, worker=None):
+        """Lease the oldest runnable job to `worker`; returns the job dict or None."""
+        worker = worker or worker_name()
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # Jobs whose worker vanished on the last allowed attempt are not retried again.
+                self._db.execute(
+                    "UPDATE jobs SET status = 'failed', error = 'worker lost', lease_until = NULL, "
+                    "updated_at = ? WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                    (now, now, self.max_attempts),
+                )
+                row = self._db.execute(
+                    "SELECT id FROM jobs WHERE (status = 'queued' AND (lease_until IS NULL OR lease_until <= ?)) "
+                    "OR (status = 'running' AND lease_until < ?) "
+                    "ORDER BY created_at LIMIT 1",
+                    (now, now),
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, "
+                        "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                        (worker, now + self.lease_seconds, now, row[0]),
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return self.get(row[0]) if row is not None else None
+
+    def report(self, job_id, worker, progress):
+        """Store partial results for the UI and extend the worker's lease."""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET progress = ?, lease_until = ?, updated_at = ? "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (json.dumps(progress), now + self.lease_seconds, now, job_id, worker),
+            )
+
+    def finish(self, job_id, worker, history_id=None, timings=None, error=None, retry=False):
+        """Mark a job done or failed and return its new status.
+
+        With `retry` a failed job is queued again, after a backoff, while attempts remain.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = CASE WHEN :error IS NULL THEN 'done' "
+                "WHEN :retry AND attempts < :max_attempts THEN 'queued' ELSE 'failed' END, "
+                # A job queued again keeps lease_until as the time it may next be claimed.
+                "lease_until = CASE WHEN :error IS NOT NULL AND :retry AND attempts < :max_attempts "
+                "THEN :now + :backoff * (1 << attempts) END, "
+                "history_id = :history_id, timings = :timings, error = :error, updated_at = :now "
+                "WHERE id = :id AND worker = :worker",
+                {"error": error, "retry": retry, "max_attempts": self.max_attempts, "now": now,
+                 "backoff": self.retry_backoff, "history_id": history_id,
+                 "timings": json.dumps(timings) if timings else None, "id": job_id, "worker": worker},
+            )
+            row = self._db.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(JOB_FIELDS, row))
+        for field in ("payload", "progress", "timings"):
+            if job[field] is not None:
+                job[field] = json.loads(job[field])
+        return job
+
+    def counts(self):
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+    def prune(self, older_than_days=7):
+        """Delete finished jobs older than `older_than_days`; returns how many were removed."""
+        with self._lock:
+            cur = self._db.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                (time.time() - older_than_days * 86400,),
+            )
+        return cur.rowcount
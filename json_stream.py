@@ -0,0 +1,72 @@
+import json
+import re
+
+_KEY_RE = re.compile(r'\s*"((?:[^"\\]|\\.)*)"\s*:')
+
+
+class JsonMemberStream:
+    """Incremental parser for a streamed JSON object such as `{"1": {...}, "2": {...}}`.
+
+    Feed it text chunks as they arrive; `feed` returns the (key, value) pairs
+    of top-level members that completed in that chunk. Text before the first
+    `{` (e.g. a ```json fence) is ignored, and a member that fails to parse
+    yields an error entry for its key without affecting the others.
+    """
+
+    def __init__(self):
+        self.buf = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.member_start = None
+        self.done = False
+
+    def feed(self, chunk):
+        self.buf += chunk
+        members = []
+        while self.pos < len(self.buf) and not self.done:
+            ch = self.buf[self.pos]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif self.depth == 0:
+                if ch == "{":
+                    self.depth = 1
+                    self.member_start = self.pos + 1
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 1 and self.member_start is not None:
+                    # A nested value just closed: emit without waiting for the comma.
+                    members.extend(self._parse(self.buf[self.member_start:self.pos + 1]))
+                    self.member_start = None
+                elif self.depth == 0:
+                    if self.member_start is not None:
+                        members.extend(self._parse(self.buf[self.member_start:self.pos]))
+                    self.done = True
+            elif ch == "," and self.depth == 1:
+                if self.member_start is not None:
+                    members.extend(self._parse(self.buf[self.member_start:self.pos]))
+                self.member_start = self.pos + 1
+            self.pos += 1
+        return members
+
+    @staticmethod
+    def _parse(text):
+        if not text.strip():
+            return []
+        try:
+            return list(json.loads("{" + text + "}").items())
+        except ValueError as e:
+            key = _KEY_RE.match(text)
+            if not key:
+                return []
+            return [(key.group(1), {"error": str(e), "raw": text})]
@@ -0,0 +1,198 @@
+"""Per-sheet latency, payload and cost metrics.
+
+The pipeline's StageTimer records every outbound call (upload service,
+Mathpix, OpenAI, history write) with its duration, bytes and token usage.
+`summarize_run` turns that into the `metrics` block stored on each history
+record, together with the process's peak RSS while the sheet was graded
+(PeakRss), and MetricsLog appends one JSON line per graded sheet to
+METRICS_PATH for the Metrics dashboard page.
+"""
+import json
+import math
+import os
+import sys
+import threading
+import time
+import weakref
+
+from history_store import HISTORY_DIR
+
+METRICS_PATH = os.path.join(HISTORY_DIR, "metrics.jsonl")
+
+# List prices in USD; update these when the providers change them.
+OPENAI_PRICES_PER_MTOK = {  # model: (input, output) per million tokens
+    "gpt-4": (30.0, 60.0),
+    "gpt-4o": (2.5, 10.0),
+}
+MATHPIX_PRICE_PER_IMAGE = 0.002
+RSS_SAMPLE_SECONDS = 0.05
+
+
+def call_cost(call):
+    if call["service"] == "mathpix":
+        return MATHPIX_PRICE_PER_IMAGE
+    if call["service"] == "openai":
+        input_price, output_price = OPENAI_PRICES_PER_MTOK.get(call.get("model"), (0.0, 0.0))
+        return (call.get("prompt_tokens", 0) * input_price
+                + call.get("completion_tokens", 0) * output_price) / 1e6
+    return 0.0
+
+
+def summarize_run(durations, calls, rss_peak_mb=None):
+    """The `metrics` block for one sheet: stage durations, calls, totals, estimated cost and peak RSS."""
+    return {
+        "stages": {name: round(secs, 4) for name, secs in durations.items()},
+        "calls": calls,
+        "tokens": {
+            "prompt": sum(c.get("prompt_tokens", 0) for c in calls),
+            "completion": sum(c.get("completion_tokens", 0) for c in calls),
+        },
+        "bytes": {
+            "out": sum(c.get("bytes_out", 0) for c in calls),
+            "in": sum(c.get("bytes_in", 0) for c in calls),
+        },
+        "cost_usd": round(sum(call_cost(c) for c in calls), 6),
+        "memory": {"rss_peak_mb": round(rss_peak_mb, 1) if rss_peak_mb is not None else None},
+    }
+
+
+# === Memory ===
+def rss_mb():
+    """Resident set size of this process in MiB.
+
+    Reads /proc on Linux; elsewhere falls back to the lifetime peak from
+    getrusage, and returns None where neither is available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+class PeakRss:
+    """Highest process RSS (MiB) seen while this object is alive.
+
+    One background thread samples RSS every RSS_SAMPLE_SECONDS for all open
+    windows, so short spikes inside a stage (decoding a photo) are caught.
+    With several sheets in flight this is the whole process's peak, which is
+    what decides whether the instance runs out of memory.
+    """
+
+    _open = weakref.WeakSet()
+    _lock = threading.Lock()
+    _sampler = None
+
+    def __init__(self):
+        self.peak_mb = rss_mb()
+        if self.peak_mb is None:
+            return
+        with PeakRss._lock:
+            PeakRss._open.add(self)
+            if PeakRss._sampler is None:
+                PeakRss._sampler = threading.Thread(target=PeakRss._sample, name="rss-sampler", daemon=True)
+                PeakRss._sampler.start()
+
+    def close(self):
+        with PeakRss._lock:
+            PeakRss._open.discard(self)
+
+    @classmethod
+    def _sample(cls):
+        while True:
+            time.sleep(RSS_SAMPLE_SECONDS)
+            with cls._lock:
+                windows = list(cls._open)
+            if not windows:
+                continue
+            current = rss_mb()
+            for window in windows:
+                if current > window.peak_mb:
+                    window.peak_mb = current
+
+
+class MetricsLog:
+    """Append-only JSON-lines file of per-sheet metrics, shared by the app and workers."""
+
+    def __init__(self, path=METRICS_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+
+    def append(self, entry):
+        line = json.dumps(entry) + "\n"
+        # One write per line on an O_APPEND file, so lines from several processes don't interleave.
+        with self._lock, open(self.path, "a") as f:
+            f.write(line)
+
+    def read(self, since_days=None):
+        if not os.path.exists(self.path):
+            return []
+        cutoff = time.time() - since_days * 86400 if since_days else None
+        entries = []
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by a crash
+                if cutoff is None or entry.get("logged_at", 0) >= cutoff:
+                    entries.append(entry)
+        return entries
+
+
+# === Aggregation for the dashboard ===
+def percentile(values, q):
+    """Nearest-rank percentile (q in 0-100) of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def stage_latency(entries):
+    """p50/p95 seconds per pipeline stage, then per outbound service, across runs."""
+    stages, calls = {}, {}
+    for entry in entries:
+        for name, secs in entry.get("stages", {}).items():
+            stages.setdefault(name, []).append(secs)
+        for call in entry.get("calls", []):
+            name = f"{call['service']} call" + (f" ({call['model']})" if call.get("model") else "")
+            calls.setdefault(name, []).append(call["seconds"])
+    return [
+        {"stage": name, "samples": len(values), "p50_s": round(percentile(values, 50), 3),
+         "p95_s": round(percentile(values, 95), 3)}
+        for name, values in sorted(stages.items()) + sorted(calls.items())
+    ]
+
+
+def memory_summary(entries):
+    """p50/p95/max of the per-sheet peak RSS (MiB), or None before any sheet recorded it."""
+    values = [entry["memory"]["rss_peak_mb"] for entry in entries
+              if (entry.get("memory") or {}).get("rss_peak_mb") is not None]
+    if not values:
+        return None
+    return {"p50": percentile(values, 50), "p95": percentile(values, 95), "max": max(values)}
+
+
+def cost_by_subject(entries):
+    totals = {}
+    for entry in entries:
+        row = totals.setdefault(entry["subject"], {
+            "subject": entry["subject"], "sheets": 0, "cost_usd": 0.0,
+            "prompt_tokens": 0, "completion_tokens": 0, "bytes_out": 0,
+        })
+        row["sheets"] += 1
+        row["cost_usd"] += entry.get("cost_usd", 0.0)
+        row["prompt_tokens"] += entry.get("tokens", {}).get("prompt", 0)
+        row["completion_tokens"] += entry.get("tokens", {}).get("completion", 0)
+        row["bytes_out"] += entry.get("bytes", {}).get("out", 0)
+    for row in totals.values():
+        row["cost_per_sheet_usd"] = round(row["cost_usd"] / row["sheets"], 4)
+        row["cost_usd"] = round(row["cost_usd"], 4)
+    return sorted(totals.values(), key=lambda row: row["subject"])
@@ -0,0 +1,253 @@
+"""Local stand-ins for Mathpix and the OpenAI chat API, with injectable latency and errors.
+
+Used by bench/bench_replay.py together with mock_upload_server.py so the whole
+grading pipeline can be exercised offline. Mathpix answers with recorded OCR
+text when it recognises the image (by SHA-256) and with a synthetic six
+question sheet otherwise; OpenAI answers in the shape each prompt asks for
+(per-question JSON schema, whole-sheet JSON or streamed prose) and reports
+token usage so cost metrics still work.
+
+    python mock_services.py --mathpix-port 8001 --openai-port 8002 --latency-ms 800 --error-rate 0.02
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Faults:
+    """Latency and error injection for one stand-in service, plus request/concurrency counters.
+
+    Each request waits `latency_ms` plus exponentially distributed jitter with
+    mean `jitter_ms` (so there is a realistic tail), then fails with probability
+    `error_rate`.
+    """
+
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.errors = 0
+            self.in_flight = 0
+            self.peak_in_flight = 0
+
+    def delay(self):
+        with self._lock:
+            jitter = self._random.expovariate(1.0 / self.jitter_ms) if self.jitter_ms else 0.0
+        time.sleep((self.latency_ms + jitter) / 1000)
+
+    def should_fail(self):
+        with self._lock:
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+            return failed
+
+    @contextmanager
+    def track(self):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self.requests, "errors": self.errors, "peak_in_flight": self.peak_in_flight}
+
+
+class _JsonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real APIs
+    faults = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, payload, status=200, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# === Mathpix ===
+SYNTHETIC_ANSWERS = ["a + b + c = 20", "60 - 6 = 54 cm^2", "7x/12 = 7, x = 12",
+                     "10/3 L orange, 16/3 L total", "9/12 = 3/4", "66 - 50 = 16"]
+# Slips for the same questions, so the answer-key check sees some wrong sheets.
+SYNTHETIC_MISTAKES = ["a + b + c = 40", "60 - 12 = 48 cm^2", "7x/12 = 7, x = 7/12",
+                      "2/3 L orange, 8/3 L total", "3/12 = 1/4", "60 - 50 = 10"]
+
+
+def synthetic_ocr_text(rng, mistake_rate=0.3):
+    """Six labelled answers, each after a few lines of working, some of them wrong."""
+    lines = []
+    for number, (answer, mistake) in enumerate(zip(SYNTHETIC_ANSWERS, SYNTHETIC_MISTAKES), start=1):
+        lines.append(f"Q{number}.")
+        lines.extend(f"working line {rng.randint(1, 99)}" for _ in range(rng.randint(1, 3)))
+        lines.append(mistake if rng.random() < mistake_rate else answer)
+    return "\n".join(lines)
+
+
+class MathpixHandler(_JsonHandler):
+    recordings = {}  # sha256 of image bytes -> OCR text
+
+    def do_POST(self):
+        with self.faults.track():
+            request = self._read_json()
+            self.faults.delay()
+            if self.faults.should_fail():
+                return self._send_json({"error": "injected failure"}, 503)
+            image = base64.b64decode(request.get("src", "").split(",", 1)[-1] or b"")
+            text = self.recordings.get(hashlib.sha256(image).hexdigest())
+            if text is None:
+                text = synthetic_ocr_text(random.Random(len(image)))
+            self._send_json({"text": text, "confidence": 0.9})
+
+
+# === OpenAI ===
+def _message_text(messages):
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(item.get("text", "") for item in content or [] if item.get("type") == "text")
+    return "\n".join(parts)
+
+
+def synthetic_completion(request, words=120):
+    """A plausible answer in the shape the pipeline's prompt asks for."""
+    prompt = _message_text(request.get("messages", []))
+    rng = random.Random(len(prompt))
+    prose = " ".join(rng.choice(["Good", "method,", "check", "the", "units", "and", "show", "each", "step."])
+                     for _ in range(words))
+    response_format = request.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        answer = re.search(r"\(OCR text\):\n(.*)", prompt)
+        return json.dumps({
+            "student_answer": answer.group(1).strip() if answer else "",
+            "correct": rng.random() < 0.7,
+            "feedback": prose[:400],
+        })
+    if "JSON object with keys 1 to 6" in prompt:
+        return json.dumps({
+            str(n): {"student_answer": SYNTHETIC_ANSWERS[n - 1], "feedback": prose[:200]} for n in range(1, 7)
+        })
+    return prose
+
+
+class OpenAIHandler(_JsonHandler):
+    token_ms = 0  # delay between streamed chunks
+
+    def do_POST(self):
+        with self.faults.track():
+            request = self._read_json()
+            self.faults.delay()
+            if self.faults.should_fail():
+                return self._send_json({"error": {"message": "injected failure", "type": "server_error"}},
+                                       503, {"Retry-After": "0"})
+            content = synthetic_completion(request)
+            usage = {
+                "prompt_tokens": len(_message_text(request.get("messages", []))) // 4,
+                "completion_tokens": len(content) // 4,
+            }
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+            if request.get("stream"):
+                return self._stream(request, content, usage)
+            self._send_json({
+                "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()),
+                "model": request.get("model"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": usage,
+            })
+
+    def _chunk(self, payload):
+        data = f"data: {json.dumps(payload)}\n\n".encode() if payload else b"data: [DONE]\n\n"
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream(self, request, content, usage):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        base = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": request.get("model")}
+        pieces = re.findall(r"\S+\s*", content) or [content]
+        for piece in pieces:
+            if self.token_ms:
+                time.sleep(self.token_ms / 1000)
+            self._chunk(dict(base, choices=[{"index": 0, "delta": {"content": piece}, "finish_reason": None}]))
+        self._chunk(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            self._chunk(dict(base, choices=[], usage=usage))
+        self._chunk(None)
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def _serve(handler, host, port, **attrs):
+    bound = type(f"Bound{handler.__name__}", (handler,), attrs)
+    server = ThreadingHTTPServer((host, port), bound)
+    server.daemon_threads = True
+    server.faults = attrs["faults"]
+    server.url = f"http://{host}:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_mathpix_server(host="127.0.0.1", port=0, faults=None, recordings=None):
+    """Start the Mathpix stand-in; POST {server.url}/v3/text."""
+    return _serve(MathpixHandler, host, port, faults=faults or Faults(), recordings=recordings or {})
+
+
+def make_openai_server(host="127.0.0.1", port=0, faults=None, token_ms=0):
+    """Start the OpenAI stand-in; use {server.url}/v1 as the client's base_url."""
+    return _serve(OpenAIHandler, host, port, faults=faults or Faults(), token_ms=token_ms)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-ins for Mathpix and OpenAI.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--mathpix-port", type=int, default=8001)
+    parser.add_argument("--openai-port", type=int, default=8002)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--token-ms", type=float, default=0, help="delay between streamed OpenAI chunks")
+    args = parser.parse_args()
+    mathpix = make_mathpix_server(args.host, args.mathpix_port,
+                                  Faults(args.latency_ms, args.jitter_ms, args.error_rate))
+    openai_server = make_openai_server(args.host, args.openai_port,
+                                       Faults(args.latency_ms, args.jitter_ms, args.error_rate), args.token_ms)
+    print(f"Mathpix stand-in on {mathpix.url}/v3/text, OpenAI stand-in on {openai_server.url}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
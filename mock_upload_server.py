@@ -0,0 +1,231 @@
+"""Local stand-in for the mathmandala-upload service.
+
+Run it with `python mock_upload_server.py --port 8000`, then start the app with
+MATHMANDALA_UPLOAD_URL=http://localhost:8000 and open
+capture.html?upload=http://localhost:8000 to exercise the full capture flow
+without touching onrender.
+"""
+import argparse
+import json
+import threading
+import time
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from mock_services import Faults
+
+
+class UploadStore:
+    def __init__(self):
+        self.files = {}  # filename -> (bytes, key)
+        self.by_key = {}  # capture token (or uploader name) -> set of filenames
+        self.cond = threading.Condition()
+        self.requests_served = 0
+
+    def count_request(self):
+        with self.cond:
+            self.requests_served += 1
+
+    def add(self, filename, data, key):
+        with self.cond:
+            self.files[filename] = (data, key)
+            self.by_key.setdefault(key, set()).add(filename)
+            self.cond.notify_all()
+
+    def listing(self):
+        with self.cond:
+            return sorted(self.files)
+
+    def get(self, filename):
+        with self.cond:
+            entry = self.files.get(filename)
+            return entry[0] if entry else None
+
+    def delete(self, filename):
+        with self.cond:
+            entry = self.files.pop(filename, None)
+            if entry is None:
+                return False
+            names = self.by_key[entry[1]]
+            names.discard(filename)
+            if not names:
+                del self.by_key[entry[1]]
+            return True
+
+    def clear(self):
+        with self.cond:
+            self.files.clear()
+            self.by_key.clear()
+
+    def _latest_for(self, key, prefix):
+        matches = sorted(f for f in self.by_key.get(key, ()) if f.startswith(prefix))
+        return matches[-1] if matches else None
+
+    def wait(self, key, prefix, timeout):
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                found = self._latest_for(key, prefix)
+                remaining = deadline - time.monotonic()
+                if found or remaining <= 0:
+                    return found
+                self.cond.wait(remaining)
+
+
+def _parse_multipart(content_type, body):
+    msg = BytesParser(policy=policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body
+    )
+    fields, files = {}, {}
+    for part in msg.iter_parts():
+        field = part.get_param("name", header="content-disposition")
+        filename = part.get_filename()
+        payload = part.get_payload(decode=True) or b""
+        if filename:
+            files[field] = (filename, payload)
+        else:
+            fields[field] = payload.decode()
+    return fields, files
+
+
+class UploadHandler(BaseHTTPRequestHandler):
+    store = None  # set by make_server
+    faults = None  # latency/errors for /uploads, /files and /delete-all, like the onrender service
+    file_delete = True  # False answers DELETE /files/<name> with 405, like a service that predates it
+    wait_endpoint = True  # False answers /wait with 404, like a service that predates the long-poll
+
+    def _injected_failure(self):
+        """Apply the configured latency; True (after sending a 503) if this request should fail."""
+        self.faults.delay()
+        if self.faults.should_fail():
+            self._send_json({"error": "injected failure"}, 503)
+            return True
+        return False
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_empty(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, DELETE, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "*")
+        self.end_headers()
+
+    def do_POST(self):
+        self.store.count_request()
+        if urlparse(self.path).path != "/upload":
+            return self._send_empty(404)
+        length = int(self.headers.get("Content-Length", 0))
+        fields, files = _parse_multipart(self.headers["Content-Type"], self.rfile.read(length))
+        if "file" not in files:
+            return self._send_json({"error": "missing file"}, 400)
+        filename, data = files["file"]
+        key = fields.get("token") or fields.get("name", "unknown")
+        self.store.add(filename, data, key)
+        self._send_json({"file": filename})
+
+    def do_GET(self):
+        self.store.count_request()
+        url = urlparse(self.path)
+        if url.path == "/uploads":
+            with self.faults.track():
+                if self._injected_failure():
+                    return
+                return self._send_json({"files": self.store.listing()})
+        if url.path == "/wait" and self.wait_endpoint:
+            query = parse_qs(url.query)
+            key = query.get("token", query.get("name", ["unknown"]))[0]
+            prefix = query.get("prefix", ["mathmandala_"])[0]
+            timeout = min(float(query.get("timeout", ["25"])[0]), 60)
+            found = self.store.wait(key, prefix, timeout)
+            if found:
+                return self._send_json({"file": found})
+            return self._send_empty(204)
+        if url.path.startswith("/files/"):
+            with self.faults.track():
+                if self._injected_failure():
+                    return
+                data = self.store.get(unquote(url.path[len("/files/"):]))
+                if data is None:
+                    return self._send_empty(404)
+                self.send_response(200)
+                self.send_header("Content-Type", "image/jpeg")
+                self.send_header("Content-Length", str(len(data)))
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                self.wfile.write(data)
+                return
+        self._send_empty(404)
+
+    def do_DELETE(self):
+        self.store.count_request()
+        with self.faults.track():
+            if self._injected_failure():
+                return
+            self._delete(urlparse(self.path).path)
+
+    def _delete(self, path):
+        if path == "/delete-all":
+            self.store.clear()
+            return self._send_json({"deleted": "all"})
+        if path.startswith("/files/"):
+            if not self.file_delete:
+                return self._send_empty(405)
+            filename = unquote(path[len("/files/"):])
+            if self.store.delete(filename):
+                return self._send_json({"deleted": filename})
+        self._send_empty(404)
+
+
+def make_server(host="127.0.0.1", port=0, faults=None, file_delete=True, wait_endpoint=True):
+    """Start the stand-in server on a background thread and return it.
+
+    `server.store` exposes the uploaded files; `server.url` is the base URL.
+    `faults` (a mock_services.Faults) adds latency and errors to the file endpoints.
+    `file_delete=False` leaves out DELETE /files/<name> and `wait_endpoint=False`
+    leaves out /wait, as on older deployments.
+    """
+    handler = type("BoundUploadHandler", (UploadHandler,),
+                   {"store": UploadStore(), "faults": faults or Faults(),
+                    "file_delete": file_delete, "wait_endpoint": wait_endpoint})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.store = handler.store
+    server.faults = handler.faults
+    server.url = f"http://{host}:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Math Mandala upload service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = make_server(args.host, args.port, Faults(args.latency_ms, args.jitter_ms, args.error_rate))
+    print(f"Mock upload server listening on {server.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
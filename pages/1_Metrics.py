@@ -0,0 +1,38 @@
+import streamlit as st
+
+import metrics
+
+# === Metrics dashboard ===
+@st.cache_data(ttl=30)
+def load_entries(since_days):
+    return metrics.MetricsLog().read(since_days)
+
+st.title("📊 Grading Metrics")
+period = st.selectbox("Period", [1, 7, 30, None],
+                      format_func=lambda days: "All time" if days is None else f"Last {days} days", index=1)
+entries = load_entries(period)
+subjects = sorted({entry["subject"] for entry in entries})
+subject = st.selectbox("Subject", ["All"] + subjects)
+if subject != "All":
+    entries = [entry for entry in entries if entry["subject"] == subject]
+
+if not entries:
+    st.info("No graded sheets recorded for this period yet.")
+    st.stop()
+
+total_cost = sum(entry.get("cost_usd", 0.0) for entry in entries)
+memory = metrics.memory_summary(entries)
+col1, col2, col3, col4 = st.columns(4)
+col1.metric("Sheets graded", len(entries))
+col2.metric("Estimated cost", f"${total_cost:.2f}")
+col3.metric("Cost per sheet", f"${total_cost / len(entries):.4f}")
+col4.metric("Peak memory (p95)", f"{memory['p95']:.0f} MiB" if memory else "n/a",
+            help="Process RSS while a sheet was graded" + (f"; max {memory['max']:.0f} MiB" if memory else ""))
+
+st.subheader("Latency per stage")
+st.caption("Pipeline stages, then individual calls to each outside service. Seconds.")
+st.dataframe(metrics.stage_latency(entries), hide_index=True, use_container_width=True)
+
+st.subheader("Cost per subject")
+st.caption("Estimated from token usage and list prices in metrics.py; cached results cost nothing.")
+st.dataframe(metrics.cost_by_subject(entries), hide_index=True, use_container_width=True)
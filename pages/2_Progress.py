@@ -0,0 +1,54 @@
+import pandas as pd
+import streamlit as st
+
+from history_store import HistoryStore
+
+# === Progress view (reads the aggregates kept by analytics.py) ===
+@st.cache_resource
+def get_history():
+    return HistoryStore()
+
+history = get_history()
+progress = history.analytics
+
+st.title("📈 Student Progress")
+student = st.selectbox("Student", [None] + history.students(),
+                       format_func=lambda name: "Whole class" if name is None else name)
+
+overview = progress.overview(student)
+if not overview:
+    st.info("No graded sessions yet.")
+    st.stop()
+
+math = next((row for row in overview if row["subject"] == "Math"), None)
+col1, col2, col3 = st.columns(3)
+col1.metric("Sessions", sum(row["sessions"] for row in overview))
+col2.metric("Math sheets", math["sessions"] if math else 0)
+col3.metric("Math accuracy",
+            f"{math['accuracy']:.0%}" if math and math.get("accuracy") is not None else "n/a")
+
+topics = progress.topics(student)
+if topics:
+    st.subheader("Accuracy by topic")
+    st.caption("Questions judged right or wrong (per-question grading or the answer key), all time.")
+    st.dataframe(
+        [{"topic": row["topic"], "questions": row["attempts"], "judged": row["graded"],
+          "accuracy": row["accuracy"], "last seen": row["last_at"]} for row in topics],
+        hide_index=True, use_container_width=True,
+        column_config={"accuracy": st.column_config.ProgressColumn("accuracy", format="%.2f",
+                                                                   min_value=0, max_value=1)},
+    )
+
+    trend = [row for row in progress.trend(student) if row["accuracy"] is not None]
+    if trend:
+        st.subheader("Weekly accuracy")
+        st.line_chart(pd.DataFrame(trend).pivot(index="week", columns="topic", values="accuracy"))
+
+    mistakes = progress.mistakes(student)
+    if mistakes:
+        st.subheader("Common mistakes")
+        st.caption("Tagged from the feedback on wrong answers.")
+        st.dataframe(mistakes, hide_index=True, use_container_width=True)
+
+st.subheader("Sessions by subject")
+st.dataframe(overview, hide_index=True, use_container_width=True)
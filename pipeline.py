@@ -0,0 +1,595 @@
+import base64
+import contextvars
+import io
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
+
+from PIL import Image
+
+import answer_key
+import http_client
+import imaging
+from json_stream import JsonMemberStream
+from history_store import HistoryStore
+import metrics
+import uploads
+
+MATHPIX_TEXT_URL = "https://api.mathpix.com/v3/text"
+
+logger = logging.getLogger(__name__)
+
+BIOLOGY_PROMPT = """
+You are a biology teacher reviewing a student's hand-drawn and labeled diagram.
+
+Please:
+- Identify whether the drawing shows the correct biological parts (e.g., nasal cavity, lungs, alveoli, etc.)
+- Judge the accuracy of label placements
+- Assess biological correctness
+- Provide clear, constructive feedback for improvement
+
+Now analyze this diagram:
+"""
+
+# Matches the `Q1.` / `Q2)` labels students write, as they come out of Mathpix.
+QUESTION_LABEL_RE = re.compile(r"^[\s\\(\[$]*Q\s*(\d+)\s*[.):](?:\s*\\\))?", re.IGNORECASE | re.MULTILINE)
+
+QUESTION_FEEDBACK_SCHEMA = {
+    "name": "question_feedback",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "student_answer": {"type": "string"},
+            "correct": {"type": "boolean"},
+            "feedback": {"type": "string"},
+        },
+        "required": ["student_answer", "correct", "feedback"],
+        "additionalProperties": False,
+    },
+}
+
+MATH_MODES = ("per_question", "whole_sheet")
+
+# History writes run here so the UI can render feedback while they finish.
+_persist_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history")
+
+
+# === Stage timing ===
+_current_timer = contextvars.ContextVar("current_timer", default=None)
+
+
+class StageTimer:
+    """Stage durations for one sheet, plus every outbound call made while it is active()."""
+
+    def __init__(self):
+        self.durations = {}
+        self.calls = []
+        self.memory = metrics.PeakRss()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] = self.durations.get(name, 0.0) + time.perf_counter() - start
+
+    @contextmanager
+    def active(self):
+        """Attribute trace_call() records in this context (and copies of it) to this timer."""
+        token = _current_timer.set(self)
+        try:
+            yield self
+        finally:
+            _current_timer.reset(token)
+
+    def add_call(self, call):
+        with self._lock:
+            self.calls.append(call)
+
+    def summary(self):
+        with self._lock:
+            return metrics.summarize_run(self.durations, list(self.calls), self.memory.peak_mb)
+
+    def report(self):
+        return " | ".join(f"{name} {secs:.2f}s" for name, secs in self.durations.items())
+
+
+@contextmanager
+def trace_call(service, timer=None, **fields):
+    """Time one outbound call; fill the yielded dict with bytes_in, token counts, etc."""
+    timer = timer or _current_timer.get()
+    call = dict(service=service, **fields)
+    start = time.perf_counter()
+    try:
+        yield call
+    except Exception as e:
+        call["error"] = type(e).__name__
+        raise
+    finally:
+        call["seconds"] = round(time.perf_counter() - start, 4)
+        if timer is not None:
+            timer.add_call(call)
+
+
+def _record_usage(call, usage):
+    if usage is not None:
+        call["prompt_tokens"] = usage.prompt_tokens
+        call["completion_tokens"] = usage.completion_tokens
+
+
+# === Rate limiting ===
+class Throttle:
+    """Caps concurrent calls to one service and spaces them to `per_minute`."""
+
+    def __init__(self, max_concurrent, per_minute=None):
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._interval = 60.0 / per_minute if per_minute else 0.0
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+    @contextmanager
+    def slot(self):
+        with self._slots:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._next_start - now
+                self._next_start = max(now, self._next_start) + self._interval
+            if wait > 0:
+                time.sleep(wait)
+            yield
+
+
+# === In-memory capture ===
+class SheetImage:
+    """One uploaded capture, held once as JPEG bytes.
+
+    The base64 form is 4/3 the size and each sheet goes to only one of
+    Mathpix or the vision model, so it is built per request and not kept.
+    """
+
+    def __init__(self, data, filename=None):
+        self.data = data
+        self.filename = filename
+
+    @classmethod
+    def decode(cls, data, filename=None):
+        # verify() checks the header and structure without decoding pixels.
+        Image.open(io.BytesIO(data)).verify()
+        return cls(data, filename)
+
+    @property
+    def data_url(self):
+        return "data:image/jpeg;base64," + base64.b64encode(self.data).decode()
+
+
+def as_pages(image):
+    """The pages of a submission: a list of SheetImages, or one SheetImage for a single sheet."""
+    return list(image) if isinstance(image, (list, tuple)) else [image]
+
+
+def segment_answers(ocr_text, question_numbers):
+    """Split OCR text on the `Q1.` ... labels into {question number: answer text}.
+
+    Returns None unless every question's label is found exactly once and in
+    order, so an ambiguous sheet falls back to whole-sheet grading.
+    """
+    matches = list(QUESTION_LABEL_RE.finditer(ocr_text))
+    numbers = [int(m.group(1)) for m in matches]
+    if numbers != sorted(int(n) for n in question_numbers):
+        return None
+    segments = {}
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(ocr_text)
+        segments[numbers[i]] = ocr_text[match.end():end].strip()
+    return segments
+
+
+# === Pipeline ===
+class GradingPipeline:
+    """fetch -> decode -> OCR -> feedback -> persist, with per-stage latency."""
+
+    def __init__(self, client, mathpix_app_id, mathpix_app_key, history=None, cache=None,
+                 throttles=None, math_mode="per_question", http=http_client.shared, metrics_log=None,
+                 mathpix_url=MATHPIX_TEXT_URL):
+        if math_mode not in MATH_MODES:
+            raise ValueError(f"math_mode must be one of {MATH_MODES}")
+        self.client = client
+        self.mathpix_app_id = mathpix_app_id
+        self.mathpix_app_key = mathpix_app_key
+        self.history = history if history is not None else HistoryStore()
+        self.cache = cache
+        self.throttles = throttles or {}
+        self.math_mode = math_mode
+        self.http = http
+        self.metrics_log = metrics_log
+        self.mathpix_url = mathpix_url
+
+    def _slot(self, service):
+        throttle = self.throttles.get(service)
+        return throttle.slot() if throttle else nullcontext()
+
+    @contextmanager
+    def _openai_call(self):
+        """Rate-limit slot plus circuit breaker for one OpenAI request.
+
+        Mathpix requests get their breaker, retries and timeouts from self.http.
+        """
+        with self._slot("openai"), self.http.breaker("openai").guard():
+            yield
+
+    def _cached(self, content, params, compute, keep=bool):
+        """Return a cached result for (content, params) or compute and store it."""
+        if self.cache is None:
+            return compute()
+        value = self.cache.get(content, params)
+        if value is None:
+            value = compute()
+            if keep(value):
+                self.cache.put(content, params, value)
+        return value
+
+    def fetch_pages(self, filenames, timer, preprocess=None):
+        """Download a submission's parts concurrently and return its SheetImages in page order.
+
+        PDF parts are expanded into one image per page.
+        """
+        def download(filename):
+            with trace_call("uploads.download", timer) as call:
+                data = uploads.download(filename)
+                call["bytes_in"] = len(data)
+            return data
+
+        def decode(page):
+            name, data = page
+            if preprocess is not None:
+                data = imaging.prepare(data, **preprocess)
+            return SheetImage.decode(data, name)
+
+        with timer.stage("fetch"):
+            with ThreadPoolExecutor(max_workers=len(filenames), thread_name_prefix="download") as pool:
+                parts = list(pool.map(download, filenames))
+        with timer.stage("decode"):
+            pages = []
+            for filename, data in zip(filenames, parts):
+                if imaging.is_pdf(data):
+                    rendered = imaging.pdf_pages(data, max_pages=uploads.MAX_PARTS)
+                    pages.extend((f"{filename}#{i}", page) for i, page in enumerate(rendered, start=1))
+                else:
+                    pages.append((filename, data))
+            pages = pages[:uploads.MAX_PARTS]
+            with ThreadPoolExecutor(max_workers=len(pages), thread_name_prefix="decode") as pool:
+                return list(pool.map(decode, pages))
+
+    def ocr(self, image, modes=("math", "text")):
+        params = {"endpoint": self.mathpix_url, "formats": ["text"], "ocr": list(modes)}
+        return self._cached(image.data, params, lambda: self._mathpix(image, modes))
+
+    def ocr_pages(self, pages, modes=("math", "text")):
+        """OCR every page concurrently and join the text in page order."""
+        if len(pages) == 1:
+            return self.ocr(pages[0], modes)
+        with ThreadPoolExecutor(max_workers=len(pages), thread_name_prefix="page") as pool:
+            # Copy this context per page so each Mathpix call reaches the caller's timer.
+            futures = [pool.submit(contextvars.copy_context().run, self.ocr, page, modes) for page in pages]
+            texts = [future.result() for future in futures]
+        return "\n\n".join(text.strip() for text in texts if text and text.strip())
+
+    def _mathpix(self, image, modes):
+        headers = {
+            "app_id": self.mathpix_app_id,
+            "app_key": self.mathpix_app_key,
+            "Content-type": "application/json"
+        }
+        options = json.dumps({"formats": ["text"], "ocr": list(modes)})
+        # Splice the base64 image into the JSON as bytes: one copy of it instead of three.
+        body = b'{"src": "data:image/jpeg;base64,' + base64.b64encode(image.data) + b'", ' + options[1:].encode()
+        with self._slot("mathpix"), trace_call("mathpix", bytes_out=len(body)) as call:
+            response = self.http.post(self.mathpix_url, "mathpix", data=body, headers=headers)
+            call["bytes_in"] = len(response.content)
+        return response.json().get("text", "")
+
+    def math_feedback(self, questions_dict, ocr_text, on_item=None):
+        """Grade all questions in one streamed call; on_item(key, entry) fires per completed question."""
+        prompt = f"""
+You are a math tutor reviewing a scanned student worksheet. You will receive:
+
+1. The full OCR text extracted from the image (including all workings).
+2. The list of 6 original questions.
+
+Your task:
+- For each question Q1 to Q6, match the student's corresponding handwritten answer from the OCR.
+- Review the student's solution using the OCR text.
+- Provide detailed feedback per question, including any mistakes and detailed steps how to correct them.
+- Return a JSON object with keys 1 to 6.
+
+OCR Text:
+{ocr_text}
+
+Questions:
+{json.dumps(questions_dict, indent=2)}
+
+Reply with JSON:
+"""
+        params = {"model": "gpt-4", "temperature": 0.2, "max_tokens": 1500}
+        messages = [{"role": "user", "content": prompt}]
+        emitted = set()
+
+        def emit(key, value):
+            emitted.add(key)
+            if on_item:
+                on_item(key, value)
+
+        def compute():
+            parser = JsonMemberStream()
+            feedback = {}
+
+            def on_delta(delta, text):
+                for key, value in parser.feed(delta):
+                    feedback[key] = value
+                    emit(key, value)
+
+            raw = self._stream_completion(messages, params, on_delta)
+            return feedback or {"error": "No JSON detected", "raw": raw}
+
+        feedback = self._cached(prompt, params, compute, keep=lambda result: "error" not in result)
+        # Cache hits arrive all at once; replay them so callers render the same way.
+        for key, value in feedback.items():
+            if key not in emitted and key not in ("error", "raw"):
+                emit(key, value)
+        return feedback
+
+    def question_feedback(self, number, question, answer_text, expected=None):
+        """Grade one question from its OCR segment with a short, schema-constrained prompt."""
+        key_line = f"\nThe answer key gives the final answer as: {expected}\n" if expected else ""
+        prompt = f"""
+You are a math tutor reviewing one question from a scanned Year 7 worksheet.
+
+Question {number}: {question}
+{key_line}
+The student's working and answer for this question (OCR text):
+{answer_text or "(nothing written)"}
+
+Give the student's final answer, whether it is correct, and detailed feedback including any mistakes and the steps to correct them.
+"""
+        params = {
+            "model": "gpt-4o",
+            "temperature": 0.2,
+            "max_tokens": 500,
+            "response_format": {"type": "json_schema", "json_schema": QUESTION_FEEDBACK_SCHEMA},
+        }
+
+        def compute():
+            messages = [{"role": "user", "content": prompt}]
+            with self._openai_call(), trace_call("openai", model=params["model"],
+                                                 bytes_out=len(json.dumps(messages))) as call:
+                response = self.client.chat.completions.create(messages=messages, **params)
+                _record_usage(call, response.usage)
+                raw = response.choices[0].message.content
+                call["bytes_in"] = len(raw or "")
+            try:
+                return json.loads(raw)
+            except (TypeError, ValueError) as e:
+                return {"error": str(e), "raw": raw}
+
+        return self._cached(prompt, params, compute, keep=lambda result: "error" not in result)
+
+    def check_answers(self, answers, segments):
+        """Check final answers against the answer key locally: {question: (verdict, answer text)}."""
+        return {
+            int(q_num): answer_key.check(expected, segments.get(int(q_num)))
+            for q_num, expected in (answers or {}).items()
+        }
+
+    def math_feedback_per_question(self, questions_dict, segments, on_item=None, answers=None):
+        """Grade every question concurrently; on_item(key, entry) fires as each one finishes.
+
+        Questions whose final answer matches the answer key are marked correct
+        without an LLM call; the rest get the expected answer in their prompt.
+        """
+        answers = answers or {}
+        checks = self.check_answers(answers, segments)
+        feedback = {}
+        for q_num in questions_dict:
+            verdict, student_answer = checks.get(int(q_num), (None, ""))
+            if verdict:
+                key = str(q_num)
+                feedback[key] = {"student_answer": student_answer, "correct": True,
+                                 "feedback": answer_key.CORRECT_FEEDBACK, "checked": "answer_key"}
+                if on_item:
+                    on_item(key, feedback[key])
+        pending = {q_num: question for q_num, question in questions_dict.items() if str(q_num) not in feedback}
+        if not pending:
+            return feedback
+        with ThreadPoolExecutor(max_workers=len(pending), thread_name_prefix="question") as pool:
+            # Each worker thread gets a copy of this context so its calls reach the caller's timer.
+            futures = {
+                pool.submit(contextvars.copy_context().run, self.question_feedback,
+                            q_num, question, segments[int(q_num)], answers.get(int(q_num))): str(q_num)
+                for q_num, question in pending.items()
+            }
+            # Callbacks run on this thread, which is the one allowed to touch the UI.
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    feedback[key] = future.result()
+                except Exception as e:
+                    feedback[key] = {"error": str(e)}
+                if on_item:
+                    on_item(key, feedback[key])
+        return feedback
+
+    def _stream_completion(self, messages, params, on_delta=None):
+        """Stream a chat completion, calling on_delta(delta, text_so_far); returns the full text."""
+        parts = []
+        with self._openai_call(), trace_call("openai", model=params["model"],
+                                             bytes_out=len(json.dumps(messages))) as call:
+            stream = self.client.chat.completions.create(
+                messages=messages, stream=True, stream_options={"include_usage": True}, **params
+            )
+            for chunk in stream:
+                # With include_usage the last chunk carries token counts and no choices.
+                _record_usage(call, getattr(chunk, "usage", None))
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    if on_delta:
+                        on_delta(delta, "".join(parts))
+            call["bytes_in"] = sum(len(part) for part in parts)
+        return "".join(parts)
+
+    def _streamed_text(self, content, params, messages, on_text=None, cache_params=None):
+        """Cached, streamed free-text feedback; on_text gets the text so far.
+
+        `cache_params` (default: `params`) keys the cache and is never sent to the API.
+        """
+        streamed = []
+
+        def on_delta(delta, text):
+            streamed.append(delta)
+            if on_text:
+                on_text(text)
+
+        text = self._cached(content, cache_params or params,
+                            lambda: self._stream_completion(messages, params, on_delta))
+        if not streamed and on_text:
+            on_text(text)
+        return text
+
+    def story_feedback(self, text, on_text=None):
+        prompt = f"""
+Evaluate this Story Mountain plan written by a Year 7 student. Give feedback on whether each part is present (Opening, Build-up, Climax, Falling Action, Ending), the creativity of the story, and how well it fits the assigned challenge.
+
+Student's Story Mountain:
+{text}
+"""
+        params = {"model": "gpt-4", "temperature": 0.3}
+        return self._streamed_text(prompt, params, [{"role": "user", "content": prompt}], on_text)
+
+    def biology_feedback(self, image, on_text=None):
+        pages = as_pages(image)
+        params = {"model": "gpt-4o", "max_tokens": 1000}
+        messages = [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": BIOLOGY_PROMPT,
+                    },
+                ] + [
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": page.data_url
+                        }
+                    }
+                    for page in pages
+                ]
+            }
+        ]
+        return self._streamed_text(b"".join(page.data for page in pages), params, messages, on_text,
+                                   cache_params=dict(params, prompt=BIOLOGY_PROMPT))
+
+    # --- Subject flows: each returns the history record for the sheet ---
+    @staticmethod
+    def _first_feedback(timer, callback):
+        """Wrap a streaming callback so the timer records time-to-first-feedback."""
+        start = time.perf_counter()
+
+        def wrapped(*args):
+            if "first_feedback" not in timer.durations:
+                timer.durations["first_feedback"] = time.perf_counter() - start
+            if callback:
+                callback(*args)
+        return wrapped
+
+    # `image` is a SheetImage or a list of them, one per page.
+    def grade_math(self, image, problems, timer, student=None, on_feedback=None, answers=None):
+        """on_feedback(question_key, entry) is called as each question's feedback completes.
+
+        `answers` is the problems' answer key ({question: "3/4"}), checked locally first.
+        """
+        pages = as_pages(image)
+        with timer.active(), timer.stage("ocr"):
+            ocr_text = self.ocr_pages(pages)
+        segments = segment_answers(ocr_text, problems) if self.math_mode == "per_question" else None
+        on_item = self._first_feedback(timer, on_feedback)
+        with timer.active(), timer.stage("feedback"):
+            if segments:
+                feedback = self.math_feedback_per_question(problems, segments, on_item, answers)
+            else:
+                feedback = self.math_feedback(problems, ocr_text, on_item)
+        feedback = feedback if isinstance(feedback, dict) else {}
+        return {
+            "timestamp": time.strftime("%Y-%m-%d_%H-%M-%S"),
+            "subject": "Math",
+            "student": student,
+            "problems": problems,
+            "answers": answers or {},
+            "ocr_text": ocr_text,
+            "feedback": feedback,
+            "grading_mode": "per_question" if segments else "whole_sheet",
+            "checked_locally": sum(1 for entry in feedback.values()
+                                   if isinstance(entry, dict) and entry.get("checked") == "answer_key"),
+            "pages": len(pages),
+        }
+
+    def grade_story(self, image, task, timer, student=None, on_text=None):
+        pages = as_pages(image)
+        with timer.active(), timer.stage("ocr"):
+            text = self.ocr_pages(pages, modes=("text",))
+        feedback = None
+        if text:
+            with timer.active(), timer.stage("feedback"):
+                feedback = self.story_feedback(text, self._first_feedback(timer, on_text))
+        return {
+            "timestamp": time.strftime("%Y-%m-%d_%H-%M-%S"),
+            "subject": "Story Mountain",
+            "student": student,
+            "task": task,
+            "text": text,
+            "feedback": feedback,
+            "pages": len(pages),
+        }
+
+    def grade_biology(self, image, task, timer, student=None, on_text=None):
+        with timer.active(), timer.stage("feedback"):
+            feedback = self.biology_feedback(image, self._first_feedback(timer, on_text))
+        return {
+            "timestamp": time.strftime("%Y-%m-%d_%H-%M-%S"),
+            "subject": "Biology",
+            "student": student,
+            "task": task,
+            "feedback": feedback,
+            "pages": len(as_pages(image)),
+        }
+
+    def persist(self, record, image, timer):
+        """Write the history record in the background; returns a Future."""
+        return _persist_pool.submit(self._persist, record, image, timer)
+
+    def _persist(self, record, image, timer):
+        # The stored record can't include its own write time; the metrics log line does.
+        record["metrics"] = timer.summary()
+        pages = as_pages(image)
+        with timer.stage("persist"):
+            data = pages[0].data if len(pages) == 1 else imaging.stack_pages([page.data for page in pages])
+            with trace_call("history.write", timer, bytes_out=len(data)):
+                record["id"] = self.history.add(record, data)
+        timer.memory.close()
+        logger.info("%s graded: %s", record["subject"], timer.report())
+        if self.metrics_log is not None:
+            self.metrics_log.append(dict(
+                timer.summary(), logged_at=time.time(), history_id=record["id"],
+                subject=record["subject"], student=record.get("student"),
+            ))
+        return record
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+RESULT_CACHE_PATH = os.path.join(".cache", "results.sqlite")
+RESULT_CACHE_MAX_BYTES = 50 * 1024 * 1024
+
+
+class ResultCache:
+    """On-disk, size-bounded LRU cache for OCR and LLM results.
+
+    Entries are keyed by the SHA-256 of the input content (image bytes or the
+    full prompt) together with the call parameters (endpoint, model, prompt
+    settings). Only exact matches are served: a near-identical photo can be a
+    different student's answers on the same printed sheet. Hit/miss counters
+    are stored alongside the entries so they survive reruns.
+    """
+
+    def __init__(self, path=RESULT_CACHE_PATH, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                params TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_params ON entries (params);
+            CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+            CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        """)
+        self._db.commit()
+
+    @staticmethod
+    def _params_key(params):
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def _content_key(content, params_key):
+        if isinstance(content, str):
+            content = content.encode()
+        return hashlib.sha256(content).hexdigest() + ":" + params_key
+
+    def _bump(self, name):
+        self._db.execute(
+            "INSERT INTO counters (name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1", (name,)
+        )
+
+    def get(self, content, params):
+        params_key = self._params_key(params)
+        key = self._content_key(content, params_key)
+        with self._lock:
+            row = self._db.execute("SELECT key, value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._bump("misses")
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), row[0]))
+            self._bump("hits")
+            self._db.commit()
+        return json.loads(row[1])
+
+    def put(self, content, params, value):
+        params_key = self._params_key(params)
+        key = self._content_key(content, params_key)
+        payload = json.dumps(value)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, params, value, size, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, params_key, payload, len(payload), time.time()),
+            )
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute(
+            "SELECT key, size FROM entries ORDER BY last_used").fetchall():
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._bump("evictions")
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    @property
+    def stats(self):
+        with self._lock:
+            counters = dict(self._db.execute("SELECT name, value FROM counters"))
+            entries, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        stats = {name: counters.get(name, 0) for name in ("hits", "misses", "evictions")}
+        stats.update(entries=entries, bytes=size)
+        return stats
@@ -0,0 +1,163 @@
+"""Pre-generated tasks per subject and difficulty, served without waiting on GPT-4.
+
+`take` always returns at once: it hands out a stored task the student has not
+seen before (or the built-in sample while the pool is still empty) and starts
+a background refill whenever a pool drops below `low_water`. Generated tasks
+are validated by the generators in `tasks` before they are stored.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from tasks import DIFFICULTIES, GENERATORS
+
+TASK_POOL_PATH = os.path.join(".cache", "task_pool.sqlite")
+
+log = logging.getLogger(__name__)
+
+# Shared across TaskPool instances so Streamlit reruns don't start duplicate refills.
+_refilling = set()
+_refilling_lock = threading.Lock()
+# After a refill that produced nothing, wait this long before trying that pool again.
+RETRY_AFTER_SECONDS = 300
+_failed_at = {}
+
+
+def _decode(subject, payload):
+    task = json.loads(payload)
+    if subject == "Math":
+        if "problems" not in task:  # stored before tasks carried an answer key
+            task = {"problems": task, "answers": {}}
+        # JSON turns the question numbers into strings.
+        task = {part: {int(number): value for number, value in task[part].items()}
+                for part in ("problems", "answers")}
+    return task
+
+
+class TaskPool:
+    def __init__(self, client, path=TASK_POOL_PATH, low_water=5, target=15, max_serves=40,
+                 max_age_days=30, max_failures=3):
+        self.client = client
+        self.low_water = low_water
+        self.target = target
+        self.max_serves = max_serves
+        self.max_age = max_age_days * 86400
+        self.max_failures = max_failures
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY,
+                subject TEXT NOT NULL,
+                difficulty TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                served_count INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS tasks_pool ON tasks (subject, difficulty, served_count);
+            CREATE TABLE IF NOT EXISTS served (
+                student TEXT NOT NULL,
+                task_id INTEGER NOT NULL REFERENCES tasks (id) ON DELETE CASCADE,
+                PRIMARY KEY (student, task_id)
+            );
+        """)
+        self._db.commit()
+
+    def _fresh(self):
+        return "created_at >= ? AND served_count < ?", [time.time() - self.max_age, self.max_serves]
+
+    def available(self, subject, difficulty):
+        fresh, args = self._fresh()
+        with self._lock:
+            return self._db.execute(
+                f"SELECT COUNT(*) FROM tasks WHERE subject = ? AND difficulty = ? AND {fresh}",
+                [subject, difficulty] + args,
+            ).fetchone()[0]
+
+    def take(self, subject, difficulty="challenging", student=None):
+        """Return a task for `student` immediately, refilling the pool in the background."""
+        fresh, args = self._fresh()
+        with self._lock, self._db:
+            row = self._db.execute(
+                f"SELECT id, payload FROM tasks WHERE subject = ? AND difficulty = ? AND {fresh} "
+                "AND id NOT IN (SELECT task_id FROM served WHERE student = ?) "
+                "ORDER BY served_count, created_at DESC LIMIT 1",
+                [subject, difficulty] + args + [student or ""],
+            ).fetchone()
+            if row is not None:
+                self._db.execute("UPDATE tasks SET served_count = served_count + 1 WHERE id = ?", (row[0],))
+                if student:
+                    self._db.execute("INSERT OR IGNORE INTO served (student, task_id) VALUES (?, ?)",
+                                     (student, row[0]))
+        if self.available(subject, difficulty) < self.low_water:
+            self.refill_async(subject, difficulty)
+        if row is None:
+            return GENERATORS[subject]()
+        return _decode(subject, row[1])
+
+    def add(self, subject, difficulty, task):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO tasks (subject, difficulty, payload, created_at) VALUES (?, ?, ?, ?)",
+                (subject, difficulty, json.dumps(task), time.time()),
+            )
+
+    def refill(self, subject, difficulty):
+        """Generate tasks until the pool reaches `target`; returns how many were added."""
+        added = failures = 0
+        while self.available(subject, difficulty) < self.target and failures < self.max_failures:
+            try:
+                task = GENERATORS[subject](self.client, difficulty)
+            except Exception as e:
+                failures += 1
+                log.warning("Task generation failed for %s/%s: %s", subject, difficulty, e)
+                continue
+            self.add(subject, difficulty, task)
+            added += 1
+        return added
+
+    def refill_async(self, subject, difficulty):
+        key = (os.path.abspath(self.path), subject, difficulty)
+        with _refilling_lock:
+            if key in _refilling or time.time() - _failed_at.get(key, 0) < RETRY_AFTER_SECONDS:
+                return
+            _refilling.add(key)
+
+        def run():
+            added = 0
+            try:
+                added = self.refill(subject, difficulty)
+                self.prune()
+            finally:
+                with _refilling_lock:
+                    _refilling.discard(key)
+                    if added:
+                        _failed_at.pop(key, None)
+                    else:
+                        _failed_at[key] = time.time()
+
+        threading.Thread(target=run, name=f"task-pool-{subject}-{difficulty}", daemon=True).start()
+
+    def warm(self):
+        for subject in GENERATORS:
+            for difficulty in DIFFICULTIES:
+                if self.available(subject, difficulty) < self.low_water:
+                    self.refill_async(subject, difficulty)
+
+    def prune(self):
+        """Drop tasks that are stale or have been served `max_serves` times."""
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM served WHERE task_id IN "
+                "(SELECT id FROM tasks WHERE created_at < ? OR served_count >= ?)",
+                (time.time() - self.max_age, self.max_serves),
+            )
+            self._db.execute("DELETE FROM tasks WHERE created_at < ? OR served_count >= ?",
+                             (time.time() - self.max_age, self.max_serves))
@@ -0,0 +1,183 @@
+import re
+
+import answer_key
+
+DIFFICULTIES = ("foundation", "standard", "challenging")
+# How each difficulty is described to the task generator.
+DIFFICULTY_PHRASES = {
+    "foundation": "accessible and confidence-building",
+    "standard": "pitched at the expected level for the year group",
+    "challenging": "challenging and thought-provoking",
+}
+
+# Every Math sheet (generated or built-in) asks question n from this area.
+MATH_TOPICS = {
+    1: "Algebra",
+    2: "Geometry",
+    3: "Fractions or Decimals",
+    4: "Ratio or Proportion",
+    5: "Probability",
+    6: "Statistics or Averages",
+}
+
+# Built-in tasks, served when no generated task is available yet.
+SAMPLE_PROBLEMS_TEXT = """
+Q1. Three numbers a, b, and c satisfy the following equations: a + b = 12; b + c = 15; a + c = 13. Find the value of a + b + c.
+Q2. A rectangle with dimensions 10 cm by 6 cm has a right-angled triangle cut out from one corner. The triangle’s legs (along the rectangle’s sides) are 4 cm and 3 cm. Calculate the area of the remaining shape.
+Q3. Solve the equation: x/3 + x/4 = 7.
+Q4. A fruit punch is made by mixing orange juice and pineapple juice in the ratio 5:3. If 2 liters of pineapple juice are used, how many liters of orange juice are needed, and what is the total volume of the punch?
+Q5. A bag contains 4 red balls, 5 blue balls, and 3 green balls. If you pick one ball without looking, what is the probability that it is not green?
+Q6. The mean of five numbers is 10. When a sixth number is added, the mean becomes 11. What is the sixth number?
+"""
+
+# Final answers for SAMPLE_PROBLEMS_TEXT, in the answer_key format.
+SAMPLE_ANSWER_KEY = {1: "20", 2: "54", 3: "12", 4: "10/3; 16/3", 5: "3/4", 6: "16"}
+
+SAMPLE_STORY_TASK = """
+* Genre: Fantasy
+* Main setting: A mystical forest filled with magical creatures and hidden realms.
+* Central character: A timid, 12-year-old girl who discovers she has the ability to communicate with animals.
+* Conflict or challenge: The girl must find and return a stolen artifact to its rightful place in order to restore peace and balance in the forest. She must overcome her shyness, build friendships with the forest creatures, and outwit the cunning thief who is determined to keep the artifact for their own selfish gains.
+"""
+
+SAMPLE_BIOLOGY_TASK = """
+Assignment:
+
+Draw and label a detailed illustration of the human respiratory system. Your drawing should include the following structures: nasal cavity, pharynx, larynx, trachea, bronchi, lungs, and alveoli.
+
+Each label should not only identify the part, but also include a brief description of its function within the system. Make sure to accurately depict the relative size and location of each structure to demonstrate your understanding of their interrelationships within the system.
+
+To further challenge your understanding of form and function, include a smaller, zoomed-in illustration of an alveolus, showing its structure and how it facilitates the exchange of oxygen and carbon dioxide.
+
+Remember, accuracy and attention to detail are crucial for this assignment. Your drawing should be neat and the labels should be clearly legible.
+"""
+
+
+def parse_problems(text):
+    problems = {}
+    for line in text.strip().split("\n"):
+        match = re.match(r'^Q?(\d+)\.\s*(.+)', line.strip())
+        if match:
+            number = int(match.group(1))
+            problems[number] = match.group(2)
+    return problems
+
+
+def parse_answers(text):
+    """`A1. 20` lines -> {1: "20"}."""
+    answers = {}
+    for line in text.strip().split("\n"):
+        match = re.match(r'^A(\d+)\.\s*(.+)', line.strip())
+        if match:
+            answers[int(match.group(1))] = match.group(2).strip()
+    return answers
+
+
+def _complete(client, prompt, temperature):
+    response = client.chat.completions.create(
+        model="gpt-4",
+        messages=[{"role": "user", "content": prompt}],
+        temperature=temperature
+    )
+    return response.choices[0].message.content
+
+
+def generate_math_task(client=None, difficulty="challenging"):
+    """{"problems": six Year 7 problems keyed 1-6, "answers": their answer key}.
+
+    Answers the local checker cannot read are left out of the key; those
+    questions are graded by the LLM alone.
+    """
+    if client is None:
+        return {"problems": parse_problems(SAMPLE_PROBLEMS_TEXT), "answers": dict(SAMPLE_ANSWER_KEY)}
+    areas = "\n".join(f"Q{number}. {topic}" for number, topic in MATH_TOPICS.items())
+    prompt = f"""
+Generate 6 diverse Year 7 math problems that are {DIFFICULTY_PHRASES[difficulty]}. Each should come from a different area:
+{areas}
+Number them from 1 to 6 in this format:
+Q1. [question text]
+...etc
+Do not put answers in the question text. After all six questions, give each final answer on its own line:
+A1. [final answer]
+...etc
+Write each final answer as a number, fraction or simplified expression with no units or words; separate several answers to one question with ";".
+"""
+    text = _complete(client, prompt, temperature=0.4)
+    problems = parse_problems(text)
+    if not validate_problems(problems):
+        raise ValueError("generated problem set did not have six usable questions")
+    answers = {
+        number: answer for number, answer in parse_answers(text).items()
+        if number in problems and answer_key.parse_expected(answer) is not None
+    }
+    return {"problems": problems, "answers": answers}
+
+
+def generate_dynamic_problems(client=None, difficulty="challenging"):
+    """Six Year 7 problems keyed 1-6; the built-in set when no client is given."""
+    return generate_math_task(client, difficulty)["problems"]
+
+
+def validate_problems(problems):
+    return (
+        sorted(problems) == [1, 2, 3, 4, 5, 6]
+        and all(len(q) >= 20 and "answer:" not in q.lower() for q in problems.values())
+    )
+
+
+def generate_story_task(client=None, difficulty="challenging"):
+    if client is None:
+        return SAMPLE_STORY_TASK
+    prompt = f"""
+Create a Story Mountain writing task for a Year 7 student.
+Provide the following only:
+
+* Genre
+* Main setting
+* Central character
+* Conflict or challenge
+
+Make it imaginative and age-appropriate. The task should be {DIFFICULTY_PHRASES[difficulty]}.
+
+Do not include the Story Mountain structure, summary, or plot outline.
+"""
+    text = _complete(client, prompt, temperature=0.5)
+    if not validate_story_task(text):
+        raise ValueError("generated story task is missing a required part")
+    return text
+
+
+def validate_story_task(text):
+    lowered = text.lower()
+    return all(part in lowered for part in ("genre", "setting", "character", "conflict"))
+
+
+def generate_biology_task(client=None, difficulty="challenging"):
+    if client is None:
+        return SAMPLE_BIOLOGY_TASK
+    prompt = f"""
+Generate a Year 8 biology drawing assignment that is {DIFFICULTY_PHRASES[difficulty]}.
+
+The assignment should ask the student to:
+- Draw and clearly label a biological system or structure
+- Include 5–8 correct labels
+- Challenge understanding of form and function
+
+Do not include the drawing or labels — only the instruction.
+"""
+    text = _complete(client, prompt, temperature=0.5)
+    if not validate_biology_task(text):
+        raise ValueError("generated biology task does not ask for a labelled drawing")
+    return text
+
+
+def validate_biology_task(text):
+    lowered = text.lower()
+    return len(text) >= 100 and "draw" in lowered and "label" in lowered
+
+
+GENERATORS = {
+    "Math": generate_math_task,
+    "Story Mountain": generate_story_task,
+    "Biology": generate_biology_task,
+}
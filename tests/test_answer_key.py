@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+from fractions import Fraction
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import answer_key
+
+# Each of these took minutes of CPU (or never finished) before powers were bounded.
+NESTED_POWERS = [
+    "((((((9^10)^10)^10)^10)^10)^10)^10",
+    "(9^9)^9",
+    "9^(1+9^9)",
+    "9^9^9^9",
+]
+
+
+def _quick(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    assert time.perf_counter() - start < 1.0
+    return result
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("20", Fraction(20)),
+    ("10/3", Fraction(10, 3)),
+    ("0.75", Fraction(3, 4)),
+    ("75%", Fraction(3, 4)),
+    ("2^10", Fraction(1024)),
+    ("2^-3", Fraction(1, 8)),
+])
+def test_parse_number(text, expected):
+    assert answer_key.parse_number(text) == expected
+
+
+@pytest.mark.parametrize("text", NESTED_POWERS + ["2^11", "9^0.5", "9" * 200, "99999999999^10 * 99999999999^10"])
+def test_parse_number_rejects_unbounded_values(text):
+    assert _quick(answer_key.parse_number, text) is None
+
+
+@pytest.mark.parametrize("text", NESTED_POWERS + ["9^(9*9*9*9*9*9*9*9)", "1/(9^9)^9"])
+def test_parse_symbolic_rejects_chained_powers(text):
+    pytest.importorskip("sympy")
+    answer_key.parse_symbolic("x")  # import SymPy outside the timed call
+    assert _quick(answer_key.parse_symbolic, text) is None
+
+
+@pytest.mark.parametrize("text", ["2x + 6", "x^2 + 3x^2", "1/x^2", "(x + 1)^2", "2^x"])
+def test_parse_symbolic_keeps_ordinary_answers(text):
+    pytest.importorskip("sympy")
+    assert answer_key.parse_symbolic(text) is not None
+
+
+@pytest.mark.parametrize("segment", [f"x = {text}" for text in NESTED_POWERS])
+def test_check_gives_up_quickly_on_nested_powers(segment):
+    assert _quick(answer_key.check, "20", segment) == (None, segment)
+
+
+@pytest.mark.parametrize("expected, segment, verdict", [
+    ("20", "4 x 5 = 20", True),
+    ("10/3", "x = 3.33", True),
+    ("10/3", "x = 3.3", False),
+    ("54 cm^2", r"Area $= 54 \mathrm{~cm}^{2}$", True),
+    ("3/4", "Answer: 0.8", False),
+])
+def test_check(expected, segment, verdict):
+    assert answer_key.check(expected, segment)[0] is verdict
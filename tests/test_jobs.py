@@ -0,0 +1,75 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jobs
+import worker
+from http_client import CircuitOpenError
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return jobs.JobQueue(str(tmp_path / "jobs.sqlite"), retry_backoff=0.2)
+
+
+def test_retried_job_waits_for_its_backoff(queue, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(jobs.time, "time", lambda: now[0])
+    queue.submit("sheet-1", "Math", {})
+    queue.claim("w")
+    assert queue.finish("sheet-1", "w", error="breaker open", retry=True) == "queued"
+    assert queue.claim("w") is None
+    now[0] += 0.2 * 2  # backoff * 2**attempts after the first attempt
+    assert queue.claim("w")["attempts"] == 2
+    assert queue.finish("sheet-1", "w", error="breaker open", retry=True) == "queued"
+    now[0] += 0.5
+    assert queue.claim("w") is None
+    now[0] += 0.3
+    assert queue.claim("w")["attempts"] == 3
+    assert queue.finish("sheet-1", "w", error="breaker open", retry=True) == "failed"
+    assert queue.get("sheet-1")["lease_until"] is None
+
+
+def test_done_and_unretried_failures(queue):
+    queue.submit("sheet-1", "Math", {})
+    queue.submit("sheet-2", "Math", {})
+    queue.claim("w")
+    assert queue.finish("sheet-1", "w", history_id=7) == "done"
+    queue.claim("w")
+    assert queue.finish("sheet-2", "w", error="no text") == "failed"
+
+
+class _FailingGrading:
+    def fetch_pages(self, filenames, timer, preprocess=None):
+        raise CircuitOpenError("uploads circuit is open")
+
+
+def _work_until_failed(queue, job_id):
+    stop = threading.Event()
+    thread = threading.Thread(target=worker.work, args=(_FailingGrading(), queue, stop, "w"))
+    thread.start()
+    try:
+        for _ in range(100):
+            if queue.get(job_id)["status"] == "failed":
+                break
+            stop.wait(0.05)
+    finally:
+        stop.set()
+        thread.join()
+    return queue.get(job_id)
+
+
+def test_outage_is_retried_with_backoff_then_uploads_are_deleted(queue, monkeypatch):
+    monkeypatch.setattr(worker, "IDLE_POLL_SECONDS", 0.02)
+    deleted = []
+    monkeypatch.setattr(worker.uploads, "delete", lambda *names: deleted.extend(names))
+    queue.submit("sub-1", "Math", {"problems": {}, "pages": ["sub-1_p1of2.jpg", "sub-1_p2of2.jpg"]})
+    job = _work_until_failed(queue, "sub-1")
+    assert job["status"] == "failed" and job["attempts"] == 3
+    # Backoffs of 0.4 s and 0.8 s between the three attempts.
+    assert job["updated_at"] - job["created_at"] >= 1.2
+    assert deleted == ["sub-1_p1of2.jpg", "sub-1_p2of2.jpg"]
@@ -0,0 +1,181 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mock_upload_server
+import uploads
+
+
+def _point_uploads_at(monkeypatch, server):
+    monkeypatch.setattr(uploads, "RENDER_UPLOADS_URL", f"{server.url}/uploads")
+    monkeypatch.setattr(uploads, "RENDER_FILE_BASE", f"{server.url}/files")
+    monkeypatch.setattr(uploads, "RENDER_DELETE_ALL", f"{server.url}/delete-all")
+    monkeypatch.setattr(uploads, "RENDER_WAIT_URL", f"{server.url}/wait")
+    monkeypatch.setattr(uploads, "_per_file_delete_missing", False)
+    monkeypatch.setattr(uploads, "_processed", set())
+
+
+@pytest.fixture
+def start_server(monkeypatch):
+    """Start a mock upload service (make_server options as keywords) and point uploads at it."""
+    servers = []
+
+    def start(**options):
+        server = mock_upload_server.make_server(**options)
+        servers.append(server)
+        _point_uploads_at(monkeypatch, server)
+        return server
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+@pytest.fixture
+def server(start_server):
+    return start_server()
+
+
+@pytest.fixture
+def legacy_delete_server(start_server):
+    """An upload service without DELETE /files/<name>."""
+    return start_server(file_delete=False)
+
+
+def upload_later(server, filename, token, delay):
+    timer = threading.Timer(delay, server.store.add, (filename, b"x", token))
+    timer.start()
+    return timer
+
+
+# === wait_for_upload ===
+def test_wait_returns_an_upload_that_is_already_there(server):
+    server.store.add("mathmandala_aaa_alice_t1.jpg", b"a", "aaa")
+    server.store.add("mathmandala_bbb_bob_t1.jpg", b"b", "bbb")
+    assert uploads.wait_for_upload("aaa", timeout=5) == "mathmandala_aaa_alice_t1.jpg"
+
+
+def test_wait_answers_as_soon_as_the_upload_arrives(server):
+    upload_later(server, "mathmandala_aaa_alice_t1.jpg", "aaa", 0.3)
+    start = time.monotonic()
+    assert uploads.wait_for_upload("aaa", timeout=10) == "mathmandala_aaa_alice_t1.jpg"
+    assert time.monotonic() - start < 2
+    assert server.store.requests_served == 1
+
+
+def test_wait_polls_again_after_an_empty_long_poll(server, monkeypatch):
+    monkeypatch.setattr(uploads, "LONG_POLL_SECONDS", 1)
+    upload_later(server, "mathmandala_aaa_alice_t1.jpg", "aaa", 1.5)
+    assert uploads.wait_for_upload("aaa", timeout=10) == "mathmandala_aaa_alice_t1.jpg"
+    # The first /wait ended with 204 after its 1 s hold.
+    assert server.store.requests_served == 2
+
+
+def test_wait_ignores_other_tokens_and_times_out(server):
+    server.store.add("mathmandala_bbb_bob_t1.jpg", b"b", "bbb")
+    start = time.monotonic()
+    assert uploads.wait_for_upload("aaa", timeout=1) is None
+    assert time.monotonic() - start < 3
+
+
+def test_wait_falls_back_to_the_listing_without_wait_endpoint(start_server, monkeypatch):
+    server = start_server(wait_endpoint=False)
+    monkeypatch.setattr(uploads, "LISTING_POLL_SECONDS", 0.1)
+    server.store.add("mathmandala_bbb_bob_t1.jpg", b"b", "bbb")
+    upload_later(server, "mathmandala_aaa_alice_t1.jpg", "aaa", 0.3)
+    assert uploads.wait_for_upload("aaa", timeout=5) == "mathmandala_aaa_alice_t1.jpg"
+    assert uploads.wait_for_upload("ccc", timeout=0.5) is None
+
+
+# === wait_for_submission ===
+def _parts(submission, total):
+    return [f"{submission}_p{i}of{total}.jpg" for i in range(1, total + 1)]
+
+
+def test_submission_of_one_capture(server):
+    server.store.add("mathmandala_aaa_alice_t1.jpg", b"a", "aaa")
+    assert uploads.wait_for_submission("aaa", timeout=5) == (
+        "mathmandala_aaa_alice_t1.jpg", ["mathmandala_aaa_alice_t1.jpg"])
+
+
+def test_submission_waits_for_every_part_in_page_order(server):
+    parts = _parts("mathmandala_aaa_alice_t1", 3)
+    for delay, name in zip((0.4, 0.1, 0.2), parts):
+        upload_later(server, name, "aaa", delay)
+    assert uploads.wait_for_submission("aaa", timeout=10) == ("mathmandala_aaa_alice_t1", parts)
+    # One /wait per part, and no listing.
+    assert server.store.requests_served == 3
+
+
+def test_newest_complete_submission_wins_over_a_broken_off_attempt(server, monkeypatch):
+    monkeypatch.setattr(uploads, "PART_WAIT_SECONDS", 0.5)
+    for name in _parts("mathmandala_aaa_alice_t1", 3)[:2]:
+        server.store.add(name, b"old", "aaa")
+    parts = _parts("mathmandala_aaa_alice_t2", 3)
+    for i, name in enumerate(parts):
+        upload_later(server, name, "aaa", 0.8 + 0.1 * i)
+    assert uploads.wait_for_submission("aaa", timeout=10) == ("mathmandala_aaa_alice_t2", parts)
+
+
+def test_incomplete_submission_times_out(server, monkeypatch):
+    monkeypatch.setattr(uploads, "PART_WAIT_SECONDS", 0.5)
+    server.store.add(_parts("mathmandala_aaa_alice_t1", 2)[0], b"p", "aaa")
+    assert uploads.wait_for_submission("aaa", timeout=1.5) is None
+
+
+def test_submission_with_too_many_parts_is_refused(server):
+    server.store.add(f"mathmandala_aaa_alice_t1_p1of{uploads.MAX_PARTS + 1}.jpg", b"p", "aaa")
+    with pytest.raises(ValueError):
+        uploads.wait_for_submission("aaa", timeout=5)
+
+
+def test_submission_parts_from_the_listing_without_wait_endpoint(start_server, monkeypatch):
+    server = start_server(wait_endpoint=False)
+    monkeypatch.setattr(uploads, "LISTING_POLL_SECONDS", 0.1)
+    parts = _parts("mathmandala_aaa_alice_t1", 2)
+    server.store.add(parts[0], b"p", "aaa")
+    upload_later(server, parts[1], "aaa", 0.3)
+    assert uploads.wait_for_submission("aaa", timeout=5) == ("mathmandala_aaa_alice_t1", parts)
+
+
+# === delete ===
+def test_delete_removes_only_the_processed_file(server):
+    server.store.add("mathmandala_aaa_alice_t1.jpg", b"a", "aaa")
+    server.store.add("mathmandala_bbb_bob_t1.jpg", b"b", "bbb")
+    uploads.delete("mathmandala_aaa_alice_t1.jpg")
+    assert server.store.listing() == ["mathmandala_bbb_bob_t1.jpg"]
+
+
+def test_delete_of_an_already_deleted_file_is_quiet(server):
+    server.store.add("mathmandala_bbb_bob_t1.jpg", b"b", "bbb")
+    uploads.delete("mathmandala_aaa_alice_t1.jpg")
+    assert server.store.listing() == ["mathmandala_bbb_bob_t1.jpg"]
+    assert not uploads._per_file_delete_missing
+
+
+def test_fallback_never_wipes_another_students_upload(legacy_delete_server):
+    store = legacy_delete_server.store
+    store.add("mathmandala_aaa_alice_t1.jpg", b"a", "aaa")
+    store.add("mathmandala_bbb_bob_t1.jpg", b"b", "bbb")
+    uploads.delete("mathmandala_aaa_alice_t1.jpg")
+    assert "mathmandala_bbb_bob_t1.jpg" in store.listing()
+    assert uploads.wait_for_upload("bbb", timeout=2) == "mathmandala_bbb_bob_t1.jpg"
+    # Once Bob's upload is processed too, nothing else is waiting and the bucket is cleared.
+    uploads.delete("mathmandala_bbb_bob_t1.jpg")
+    assert store.listing() == []
+
+
+def test_fallback_clears_a_multi_page_submission_with_one_delete_all(legacy_delete_server):
+    store = legacy_delete_server.store
+    parts = [f"mathmandala_aaa_alice_t1_p{i}of3.jpg" for i in (1, 2, 3)]
+    for name in parts:
+        store.add(name, b"p", "aaa")
+    before = store.requests_served
+    uploads.delete(*parts)
+    assert store.listing() == []
+    # One DELETE /files probe, one listing and one /delete-all.
+    assert store.requests_served - before == 3
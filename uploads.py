@@ -0,0 +1,196 @@
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from urllib.parse import quote
+
+import requests
+
+from http_client import shared as http
+
+logger = logging.getLogger(__name__)
+
+# === Upload service endpoints ===
+UPLOAD_SERVICE_URL = os.environ.get(
+    "MATHMANDALA_UPLOAD_URL", "https://mathmandala-upload.onrender.com"
+).rstrip("/")
+RENDER_UPLOADS_URL = f"{UPLOAD_SERVICE_URL}/uploads"
+RENDER_FILE_BASE = f"{UPLOAD_SERVICE_URL}/files"
+RENDER_DELETE_ALL = f"{UPLOAD_SERVICE_URL}/delete-all"
+RENDER_WAIT_URL = f"{UPLOAD_SERVICE_URL}/wait"
+
+# How long the upload service may hold one /wait request open.
+LONG_POLL_SECONDS = 25
+# Interval for the legacy listing poll, used only when /wait is not deployed.
+LISTING_POLL_SECONDS = 2
+# How long to wait for a missing part before checking for a newer submission from the same token.
+PART_WAIT_SECONDS = 5
+MAX_PARTS = 10
+
+# capture.html names part i of n `<submission>_p<i>of<n>.jpg` (or .pdf); single captures have no suffix.
+PART_RE = re.compile(r"_p(\d+)of(\d+)\.(?:jpg|pdf)$")
+UPLOAD_EXTENSIONS = (".jpg", ".pdf")
+
+# Set once the upload service turns out to lack DELETE /files/<name>.
+_per_file_delete_missing = False
+# Without per-file delete: uploads this process has finished with but could not remove.
+_processed = set()
+_processed_lock = threading.Lock()
+
+
+def new_capture_token():
+    return uuid.uuid4().hex[:12]
+
+
+def wait_for_upload(token, prefix="mathmandala_", timeout=120):
+    """Block until a capture tagged with `token` is uploaded and return its filename.
+
+    Uses the /wait long-poll endpoint, which answers as soon as capture.html
+    finishes an upload carrying that token (or immediately if one is already
+    waiting). Returns None when nothing arrives within `timeout` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        hold = max(1, int(min(LONG_POLL_SECONDS, remaining)))
+        try:
+            res = http.get(
+                RENDER_WAIT_URL,
+                "uploads.wait",
+                params={"token": token, "prefix": prefix, "timeout": hold},
+                timeout=(5, hold + 10),
+                retry=False,
+                long_poll=True,
+            )
+        except requests.RequestException:
+            time.sleep(min(LISTING_POLL_SECONDS, max(0, remaining)))
+            continue
+        if res.status_code == 200:
+            filename = res.json().get("file")
+            if filename:
+                return filename
+        elif res.status_code == 404:
+            # Upload service predates /wait: fall back to scanning the listing.
+            return _poll_listing(token, prefix, deadline)
+        elif res.status_code != 204:
+            time.sleep(LISTING_POLL_SECONDS)
+
+
+def split_part(filename):
+    """Return (submission id, part number, total parts) for an uploaded filename."""
+    match = PART_RE.search(filename)
+    if not match:
+        return filename, 1, 1
+    return filename[:match.start()], int(match.group(1)), int(match.group(2))
+
+
+def wait_for_submission(token, prefix="mathmandala_", timeout=120):
+    """Like wait_for_upload, but returns every part of a multi-page submission.
+
+    Each missing part is awaited on /wait with its own filename as the prefix.
+    The newest upload for the token decides which submission that is, so a
+    complete resubmission wins over an earlier attempt that uploaded only
+    some of its parts. Returns (submission id, filenames in page order), or
+    None when no complete submission arrives within `timeout` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    submission, parts = None, {}
+    while True:
+        filename = wait_for_upload(token, prefix, deadline - time.monotonic())
+        if not filename:
+            return None
+        newest, number, total = split_part(filename)
+        if total == 1:
+            return newest, [filename]
+        if total > MAX_PARTS:
+            raise ValueError(f"A submission can have at most {MAX_PARTS} pages.")
+        if newest != submission:
+            submission, parts = newest, {}
+        parts[number] = filename
+        for part in range(1, total + 1):
+            if part in parts:
+                continue
+            hold = min(PART_WAIT_SECONDS, deadline - time.monotonic())
+            found = wait_for_upload(token, f"{submission}_p{part}of{total}.", hold)
+            if not found:
+                break
+            parts[part] = found
+        if len(parts) == total:
+            return submission, [parts[part] for part in sorted(parts)]
+
+
+def _listing():
+    res = http.get(RENDER_UPLOADS_URL, "uploads.list")
+    res.raise_for_status()
+    return res.json().get("files", [])
+
+
+def _poll_listing(token, prefix, deadline):
+    # A part's prefix (see wait_for_submission) already includes the token.
+    token_prefix = prefix if token in prefix else f"{prefix}{token}_"
+    while time.monotonic() < deadline:
+        try:
+            files = sorted(
+                f for f in _listing() if f.startswith(token_prefix) and f.endswith(UPLOAD_EXTENSIONS)
+            )
+            if files:
+                return files[-1]
+        except requests.RequestException:
+            pass
+        time.sleep(LISTING_POLL_SECONDS)
+    return None
+
+
+def download(filename):
+    res = http.get(f"{RENDER_FILE_BASE}/{quote(filename)}", "uploads.file")
+    res.raise_for_status()
+    return res.content
+
+
+def delete(*filenames):
+    """Remove processed uploads (e.g. every part of a submission), leaving other sessions' captures alone.
+
+    Upload services without `DELETE /files/<name>` only get the legacy
+    /delete-all once every capture in the listing has been processed here;
+    until then the files are left in place rather than risk another
+    student's unclaimed upload.
+    """
+    global _per_file_delete_missing
+    pending = []
+    for filename in filenames:
+        if _per_file_delete_missing:
+            pending.append(filename)
+            continue
+        res = http.delete(f"{RENDER_FILE_BASE}/{quote(filename)}", "uploads.delete")
+        if res.status_code not in (404, 405):
+            res.raise_for_status()
+            continue
+        # A 404 also means the file is already gone; only a file still listed shows the route is missing.
+        if res.status_code == 404 and filename not in _listing():
+            continue
+        logger.warning("Upload service has no DELETE /files/<name> (HTTP %s); processed uploads are only "
+                       "cleared with /delete-all when no other capture is waiting", res.status_code)
+        _per_file_delete_missing = True
+        pending.append(filename)
+    if pending:
+        _delete_all_if_processed(pending)
+
+
+def _delete_all_if_processed(filenames):
+    with _processed_lock:
+        _processed.update(filenames)
+        waiting = [f for f in _listing() if f.startswith("mathmandala_") and f not in _processed]
+        if waiting:
+            logger.info("Leaving %d processed uploads in place: %d other captures are waiting",
+                        len(_processed), len(waiting))
+            return
+        delete_all()
+        _processed.clear()
+
+
+def delete_all():
+    http.delete(RENDER_DELETE_ALL, "uploads.delete").raise_for_status()
@@ -0,0 +1,161 @@
+"""Grading worker: claims jobs from the queue and runs OCR, feedback and history writes.
+
+    python worker.py --threads 2
+    python worker.py --threads 4 --queue-db /data/jobs.sqlite --history-db /data/history.sqlite
+
+Run as many worker processes as the API rate limits allow; they share the
+queue and history databases, so they must run on the same machine (or share
+the disk) as the app. The app also starts `IN_APP_WORKERS` worker threads of
+its own for single-process deployments.
+"""
+import argparse
+import logging
+import threading
+import time
+
+import imaging
+import pipeline
+import uploads
+from batch_grade import build_pipeline
+from history_store import HISTORY_DB_PATH
+from jobs import JOBS_DB_PATH, JobQueue, worker_name
+from metrics import METRICS_PATH, MetricsLog
+
+PROGRESS_INTERVAL = 0.5
+IDLE_POLL_SECONDS = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+class NoTextError(ValueError):
+    """The sheet had nothing to grade; retrying will not help."""
+
+
+class ProgressReporter:
+    """Collects streamed feedback and writes it to the job at most every PROGRESS_INTERVAL s."""
+
+    def __init__(self, queue, job_id, worker):
+        self.queue = queue
+        self.job_id = job_id
+        self.worker = worker
+        self.progress = {}
+        self._last_write = 0.0
+
+    def _write(self, force=False):
+        now = time.monotonic()
+        if force or now - self._last_write >= PROGRESS_INTERVAL:
+            self._last_write = now
+            self.queue.report(self.job_id, self.worker, self.progress)
+
+    def item(self, key, entry):
+        self.progress.setdefault("feedback", {})[str(key)] = entry
+        # Each question is its own event, so don't hold it back.
+        self._write(force=True)
+
+    def text(self, text):
+        self.progress["text"] = text
+        self._write()
+
+
+def upload_names(job):
+    # Multi-page submissions list their parts; older single-capture jobs are keyed by the filename.
+    return job["payload"].get("pages") or [job["id"]]
+
+
+def delete_uploads(job):
+    filenames = upload_names(job)
+    try:
+        uploads.delete(*filenames)
+    except Exception as e:
+        logger.warning("Could not delete uploads %s: %s", filenames, e)
+
+
+def run_job(grading, queue, job, worker):
+    """Grade one claimed job and record its history id; returns the history record."""
+    payload = job["payload"]
+    subject = job["subject"]
+    filenames = upload_names(job)
+    student = payload.get("student")
+    timer = pipeline.StageTimer()
+    # Time spent before this worker got the job: waiting for the capture, then in the queue.
+    if "upload_wait_s" in payload:
+        timer.durations["upload_wait"] = payload["upload_wait_s"]
+    if job["attempts"] == 1:
+        timer.durations["queue_wait"] = max(0.0, time.time() - job["created_at"])
+    image = grading.fetch_pages(filenames, timer, preprocess=imaging.settings_for(subject))
+
+    reporter = ProgressReporter(queue, job["id"], worker)
+    if subject == "Math":
+        # JSON turns the question numbers into strings.
+        problems = {int(number): question for number, question in payload["problems"].items()}
+        answers = {int(number): answer for number, answer in payload.get("answers", {}).items()}
+        record = grading.grade_math(image, problems, timer, student=student, on_feedback=reporter.item,
+                                    answers=answers)
+    elif subject == "Story Mountain":
+        record = grading.grade_story(image, payload["task"], timer, student=student, on_text=reporter.text)
+        if not record["text"]:
+            raise NoTextError("No text was recognised on the sheet.")
+    else:
+        record = grading.grade_biology(image, payload["task"], timer, student=student, on_text=reporter.text)
+    record = grading.persist(record, image, timer).result()
+    queue.finish(job["id"], worker, history_id=record["id"], timings=timer.durations)
+    delete_uploads(job)
+    return record
+
+
+def work(grading, queue, stop=None, worker=None):
+    """Claim and run jobs until `stop` is set."""
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        name = worker or worker_name()
+        job = queue.claim(name)
+        if job is None:
+            stop.wait(IDLE_POLL_SECONDS)
+            continue
+        status = None
+        try:
+            run_job(grading, queue, job, name)
+        except NoTextError as e:
+            status = queue.finish(job["id"], name, error=str(e))
+        except Exception as e:
+            logger.exception("Job %s failed", job["id"])
+            status = queue.finish(job["id"], name, error=str(e), retry=True)
+        if status == "failed":
+            # Nothing will read the uploads of a job that has failed for good.
+            delete_uploads(job)
+
+
+def start_threads(grading, queue, count):
+    """Run `count` worker threads in this process; returns the Event that stops them."""
+    stop = threading.Event()
+    for i in range(count):
+        threading.Thread(target=work, args=(grading, queue, stop), name=f"grading-worker-{i}",
+                         daemon=True).start()
+    return stop
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run Math Mandala grading workers.")
+    parser.add_argument("--threads", type=int, default=2, help="jobs graded concurrently by this process")
+    parser.add_argument("--queue-db", default=JOBS_DB_PATH)
+    parser.add_argument("--history-db", default=HISTORY_DB_PATH)
+    parser.add_argument("--math-mode", choices=pipeline.MATH_MODES, default="per_question")
+    parser.add_argument("--metrics-file", default=METRICS_PATH)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(threadName)s %(message)s")
+    grading = build_pipeline(args.history_db, math_mode=args.math_mode,
+                             metrics_log=MetricsLog(args.metrics_file))
+    queue = JobQueue(args.queue_db)
+    stop = start_threads(grading, queue, args.threads)
+    logger.info("%d grading workers on %s", args.threads, args.queue_db)
+    try:
+        while True:
+            time.sleep(60)
+            queue.prune()
+    except KeyboardInterrupt:
+        stop.set()
+
+
+if __name__ == "__main__":
+    main()